@@ -6,10 +6,10 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from modules.common.src.app_utils.Logger import get_logger
-from modules.common.src.app_utils.Reader import Reader, get_readers
+from modules.common.src.app_utils.CohortLoader import load_cohort
+from modules.common.src.app_utils.Reader import Reader
 
-dirs = Reader.filter_data_folders_by_type(Reader.DirType.DIR_TYPE_SPECIMEN)
-readers = get_readers(dirs, to_left=['P01', 'P02', 'P03'])
-for reader in readers:
-    dag = reader.load_data(Reader.DataStep.DAG_WITH_STATS_FILENAME)
+for reader, data in load_cohort([Reader.DataStep.DAG_WITH_STATS_FILENAME], dir_type=Reader.DirType.DIR_TYPE_SPECIMEN,
+                                to_left=['P01', 'P02', 'P03']):
+    dag = data[Reader.DataStep.DAG_WITH_STATS_FILENAME]
     get_logger().debug(dag.get_shape())
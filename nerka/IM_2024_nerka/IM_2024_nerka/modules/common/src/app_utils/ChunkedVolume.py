@@ -0,0 +1,129 @@
+import bz2
+import itertools
+import json
+import lzma
+import mmap
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Optional
+
+import numpy as np
+
+MAGIC = b'CHUNKVOL'
+HEADER_LENGTH_FORMAT = '<Q'
+DEFAULT_CHUNK_SHAPE = (64, 64, 64)
+DEFAULT_CODEC = 'zlib'
+DEFAULT_COMPRESSION_LEVEL = 6
+
+CODECS: dict[str, tuple[Callable[[bytes, int], bytes], Callable[[Any], bytes]]] = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'bz2': (lambda data, level: bz2.compress(data, max(level, 1)), bz2.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+BBox = tuple[tuple[int, ...], tuple[int, ...]]
+
+
+def clip_bbox(bbox: BBox, shape: tuple) -> BBox:
+    start = tuple(min(max(int(x), 0), size) for x, size in zip(bbox[0], shape))
+    stop = tuple(min(max(int(x), begin), size) for x, begin, size in zip(bbox[1], start, shape))
+    return start, stop
+
+
+def bbox_to_slices(bbox: BBox) -> tuple[slice, ...]:
+    return tuple(slice(begin, end) for begin, end in zip(*bbox))
+
+
+def save_chunked(output: BinaryIO, data: np.ndarray, chunk_shape: tuple = DEFAULT_CHUNK_SHAPE,
+                 codec: str = DEFAULT_CODEC, level: int = DEFAULT_COMPRESSION_LEVEL, workers: int = None) -> None:
+    if codec not in CODECS:
+        raise ValueError(f'Unknown codec {codec}, available codecs: {list(CODECS.keys())}')
+    compress = CODECS[codec][0]
+    data = np.asarray(data)
+    chunk_shape = tuple(min(size, chunk) for size, chunk in zip(data.shape, chunk_shape))
+
+    def compress_chunk(chunk_index: tuple) -> bytes:
+        chunk = data[_get_chunk_slices(chunk_index, chunk_shape, data.shape)]
+        return b'' if not chunk.any() else compress(np.ascontiguousarray(chunk).tobytes(), level)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        blobs = list(executor.map(compress_chunk, _iterate_chunk_indices(data.shape, chunk_shape)))
+    header = {'shape': data.shape, 'dtype': data.dtype.str, 'chunk_shape': chunk_shape, 'codec': codec, 'chunks': []}
+    offset = 0
+    for blob in blobs:
+        header['chunks'].append((offset, len(blob)))
+        offset += len(blob)
+    header_bytes = json.dumps(header).encode()
+    output.write(MAGIC)
+    output.write(struct.pack(HEADER_LENGTH_FORMAT, len(header_bytes)))
+    output.write(header_bytes)
+    for blob in blobs:
+        output.write(blob)
+
+
+class ChunkedVolume:
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        with open(file_name, 'rb') as input_:
+            if input_.read(len(MAGIC)) != MAGIC:
+                raise IOError(f'File {file_name} is not a chunked volume')
+            header_length = struct.unpack(HEADER_LENGTH_FORMAT, input_.read(struct.calcsize(HEADER_LENGTH_FORMAT)))[0]
+            header = json.loads(input_.read(header_length))
+        self.__data_offset = len(MAGIC) + struct.calcsize(HEADER_LENGTH_FORMAT) + header_length
+        self.shape = tuple(header['shape'])
+        self.dtype = np.dtype(header['dtype'])
+        self.chunk_shape = tuple(header['chunk_shape'])
+        self.codec = header['codec']
+        if self.codec not in CODECS:
+            raise IOError(f'File {file_name} uses unknown codec {self.codec}')
+        self.__chunks = [tuple(x) for x in header['chunks']]
+        self.__grid_shape = tuple(-(-size // chunk) for size, chunk in zip(self.shape, self.chunk_shape))
+
+    def get_chunk_indices(self, bbox: Optional[BBox] = None) -> list[tuple]:
+        if bbox is None:
+            return list(_iterate_chunk_indices(self.shape, self.chunk_shape))
+        start, stop = clip_bbox(bbox, self.shape)
+        ranges = [range(begin // chunk, -(-end // chunk)) for begin, end, chunk in zip(start, stop, self.chunk_shape)]
+        return list(itertools.product(*ranges))
+
+    def read(self, bbox: Optional[BBox] = None, workers: int = None) -> np.ndarray:
+        start, stop = clip_bbox(bbox, self.shape) if bbox is not None else ((0,) * len(self.shape), self.shape)
+        result = np.zeros(tuple(end - begin for begin, end in zip(start, stop)), dtype=self.dtype)
+        chunk_indices = self.get_chunk_indices((start, stop))
+        if result.size == 0 or len(chunk_indices) == 0:
+            return result
+        decompress = CODECS[self.codec][1]
+        with open(self.file_name, 'rb') as input_, mmap.mmap(input_.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            def read_chunk(chunk_index: tuple) -> None:
+                chunk_slices = _get_chunk_slices(chunk_index, self.chunk_shape, self.shape)
+                offset, length = self.__chunks[np.ravel_multi_index(chunk_index, self.__grid_shape)]
+                if length == 0:
+                    return
+                begin = self.__data_offset + offset
+                chunk = np.frombuffer(decompress(buffer[begin:begin + length]), dtype=self.dtype)
+                chunk = chunk.reshape(tuple(x.stop - x.start for x in chunk_slices))
+                source, target = [], []
+                for chunk_slice, begin_, end_ in zip(chunk_slices, start, stop):
+                    low, high = max(chunk_slice.start, begin_), min(chunk_slice.stop, end_)
+                    source.append(slice(low - chunk_slice.start, high - chunk_slice.start))
+                    target.append(slice(low - begin_, high - begin_))
+                result[tuple(target)] = chunk[tuple(source)]
+
+            if len(chunk_indices) == 1 or workers == 1:
+                for chunk_index in chunk_indices:
+                    read_chunk(chunk_index)
+            else:
+                with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                    list(executor.map(read_chunk, chunk_indices))
+        return result
+
+
+def _iterate_chunk_indices(shape: tuple, chunk_shape: tuple):
+    return itertools.product(*[range(-(-size // chunk)) for size, chunk in zip(shape, chunk_shape)])
+
+
+def _get_chunk_slices(chunk_index: tuple, chunk_shape: tuple, shape: tuple) -> tuple[slice, ...]:
+    return tuple(slice(i * chunk, min((i + 1) * chunk, size)) for i, chunk, size in zip(chunk_index, chunk_shape, shape))
@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Iterator, Union
+
+from modules.common.src.app_utils.Logger import get_logger
+from modules.common.src.app_utils.Reader import Reader, get_readers
+from modules.common.src.model.DAG import DAG
+from modules.common.src.model.VolumeData import VolumeData
+
+CaseResult = tuple[Reader, dict[Reader.DataStep, Union[VolumeData, DAG, None]]]
+
+
+def load_cohort(steps: list[Reader.DataStep], dir_names: list[str] = None, dir_type: Reader.DirType = None,
+                to_left: list = None, workers: int = None, use_processes: bool = False, max_in_flight: int = None,
+                default_size: int = None, use_cache: bool = False) -> Iterator[CaseResult]:
+    if dir_names is None:
+        dir_names = Reader.get_all_data_folders() if dir_type is None else Reader.filter_data_folders_by_type(dir_type)
+    readers = get_readers(sorted(dir_names), to_left=to_left, default_size=default_size, use_cache=use_cache)
+    workers = os.cpu_count() if workers is None else workers
+    max_in_flight = 2 * workers if max_in_flight is None else max_in_flight
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        yield from _load_in_completion_order(executor, readers, steps, max_in_flight)
+
+
+def _load_in_completion_order(executor: Executor, readers: list[Reader], steps: list[Reader.DataStep],
+                              max_in_flight: int) -> Iterator[CaseResult]:
+    pending_readers = iter(readers)
+    in_flight: set[Future] = set()
+    try:
+        while True:
+            while len(in_flight) < max_in_flight:
+                reader = next(pending_readers, None)
+                if reader is None:
+                    break
+                in_flight.add(executor.submit(load_case, reader, steps))
+            if len(in_flight) == 0:
+                return
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def load_case(reader: Reader, steps: list[Reader.DataStep]) -> CaseResult:
+    get_logger().debug(f'Loading case {reader.tree_name}')
+    return reader, {step: reader.load_data(step) for step in steps}
@@ -0,0 +1,117 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, TextIO
+
+import numpy as np
+import pandas as pd
+
+from modules.common.src.app_utils.Logger import get_logger, log_execution
+from modules.common.src.app_utils.Reader import Reader
+
+STATISTICS_FILENAME = 'cohort_statistics.csv'
+FINGERPRINTS_SUFFIX = '.fingerprints.json'
+FEATURES_VERSION = 2
+CASE_COLUMN = 'case'
+DAG_DATA_COLUMNS = ['3d_volume_vasculature', 'vascular_network_projection_area', 'vascular_density', 'branching_points',
+                    'branching_points_per_pixel', 'fractal_dimension']
+GENERATION_FEATURES = {'length': 'length', 'mean_thickness': 'thickness', 'relative_angle': 'angle'}
+MAX_NODE_LEVEL = 3
+
+
+def get_statistics_name() -> str:
+    return os.path.join(os.path.dirname(os.path.normpath(Reader.DATA_DIR)), STATISTICS_FILENAME)
+
+
+def compute_case_features(reader: Reader) -> Optional[dict[str, Any]]:
+    dag = reader.load_data(Reader.DataStep.DAG_WITH_STATS_FILENAME)
+    if dag is None:
+        return None
+    table = dag.get_edge_table()
+    lengths = table.get_column('length').astype(np.float64)
+    features = {CASE_COLUMN: reader.tree_name, 'Branch count': len(dag.edges), 'Total edge length': np.nansum(lengths),
+                'Mean edge length': np.nanmean(lengths) if np.any(~np.isnan(lengths)) else np.nan}
+    for name in DAG_DATA_COLUMNS:
+        value = dag.data.get(name, None)
+        features[name] = float(value) if value is not None and np.isscalar(value) else np.nan
+    features.update({'nodes': len(dag.nodes), 'full_levels': dag.get_number_of_full_levels()})
+    child_counts = np.bincount([len(node.edges) for node in dag.nodes], minlength=MAX_NODE_LEVEL + 1)
+    for level in range(MAX_NODE_LEVEL + 1):
+        features[f'nodes_level_{level}'] = int(child_counts[level])
+    features[f'nodes_level_{MAX_NODE_LEVEL}_or_more'] = int(child_counts[MAX_NODE_LEVEL:].sum())
+    for column, name in GENERATION_FEATURES.items():
+        summary = table.aggregate(column, by='generation', statistics=('count', 'mean', 'std'), quantiles=(0.5,))
+        for i, generation in enumerate(summary['generation'].tolist()):
+            features[f'{name}_mean_g{generation}'] = summary['mean'][i]
+            features[f'{name}_std_g{generation}'] = summary['std'][i]
+            features[f'{name}_median_g{generation}'] = summary['q0.5'][i]
+            if column == 'length':
+                features[f'count_g{generation}'] = int(summary['count'][i])
+    return features
+
+
+def get_case_fingerprint(reader: Reader) -> Optional[list]:
+    exists, full_name = reader.datafile_exists(Reader.DataStep.DAG_WITH_STATS_FILENAME)
+    if not exists:
+        return None
+    stat = os.stat(full_name)
+    return [FEATURES_VERSION, os.path.basename(full_name), stat.st_size, stat.st_mtime_ns]
+
+
+@log_execution
+def build_cohort_statistics(dir_names: list[str] = None, dir_type: Reader.DirType = None, output_name: str = None,
+                            workers: int = None, use_processes: bool = True, force: bool = False) -> pd.DataFrame:
+    if dir_names is None:
+        dir_names = Reader.get_all_data_folders() if dir_type is None else Reader.filter_data_folders_by_type(dir_type)
+    output_name = get_statistics_name() if output_name is None else output_name
+    fingerprints_name = os.path.splitext(output_name)[0] + FINGERPRINTS_SUFFIX
+    table = pd.read_csv(output_name) if os.path.exists(output_name) and not force else pd.DataFrame({CASE_COLUMN: []})
+    fingerprints = {}
+    if os.path.exists(fingerprints_name) and not force:
+        with open(fingerprints_name) as input_:
+            fingerprints = json.load(input_)
+
+    current = {x: get_case_fingerprint(Reader(x, use_cache=False)) for x in sorted(dir_names)}
+    missing = [x for x, fingerprint in current.items() if fingerprint is None]
+    if len(missing) > 0:
+        get_logger().warning(f'Cases without {Reader.DataStep.DAG_WITH_STATS_FILENAME.get_name()}: {missing}')
+    known = set(table[CASE_COLUMN].astype(str))
+    stale = [x for x, fingerprint in current.items()
+             if fingerprint is not None and (fingerprints.get(x, None) != fingerprint or x not in known)]
+    get_logger().info(f'Computing statistics of {len(stale)} out of {len(current)} cases')
+
+    rows = []
+    if len(stale) > 0:
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=min(len(stale), workers or os.cpu_count())) as executor:
+            rows = [x for x in executor.map(_compute_case_row, stale, [Reader.DATA_DIR] * len(stale)) if x is not None]
+
+    replaced = set(stale) | set(missing)
+    table = table[~table[CASE_COLUMN].astype(str).isin(replaced)]
+    if len(rows) > 0:
+        table = pd.concat([x for x in [table, pd.DataFrame(rows)] if len(x) > 0], ignore_index=True)
+    table = table.sort_values(CASE_COLUMN, kind='stable').reset_index(drop=True)
+    for name in replaced:
+        fingerprints.pop(name, None)
+    fingerprints.update({x[CASE_COLUMN]: current[x[CASE_COLUMN]] for x in rows})
+    table = table.set_index(CASE_COLUMN)
+    _write_atomically(output_name, lambda output: table.to_csv(output))
+    _write_atomically(fingerprints_name, lambda output: json.dump(fingerprints, output))
+    return table
+
+
+def _compute_case_row(tree_name: str, data_dir: str) -> Optional[dict[str, Any]]:
+    Reader.DATA_DIR = data_dir
+    return compute_case_features(Reader(tree_name, use_cache=False))
+
+
+def _write_atomically(full_name: str, write: Callable[[TextIO], Any]) -> None:
+    temp_name = f'{full_name}.{os.getpid()}.tmp'
+    try:
+        with open(temp_name, 'w', newline='') as output:
+            write(output)
+        os.replace(temp_name, full_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
@@ -0,0 +1,289 @@
+import json
+from dataclasses import fields
+from typing import Any, Callable, Optional, Sequence
+
+import numpy as np
+
+from modules.common.src.model.AttributeStore import MISSING, ArrayColumn, AttributeStore, ObjectColumn, RaggedColumn, \
+    ReferenceColumn
+from modules.common.src.model.CompactDAG import CompactDAG, EdgeView, NodeView
+from modules.common.src.model.DAG import DAG
+from modules.common.src.model.Edge import Edge
+from modules.common.src.model.EdgeData import EdgeData
+from modules.common.src.model.Node import Node
+
+FORMAT_VERSION = 1
+SCHEMA_KEY = '__schema__'
+EDGE_DATA_FIELDS = [x.name for x in fields(EdgeData)]
+PYTHON_SCALAR_TYPES = [bool, int, float]
+
+
+def save_columnar_dag(output: Any, dag: DAG) -> None:
+    np.savez(output, **encode_dag(dag))
+
+
+def load_columnar_dag(file_name: str, compact: bool = False) -> DAG:
+    with np.load(file_name, allow_pickle=False) as input_:
+        arrays = {key: input_[key] for key in input_.files}
+    schema = json.loads(str(arrays[SCHEMA_KEY]))
+    if schema['version'] != FORMAT_VERSION:
+        raise IOError(f'Unsupported columnar DAG version {schema["version"]} in {file_name}')
+    return decode_dag(arrays, compact)
+
+
+def to_compact_dag(dag: DAG) -> CompactDAG:
+    return dag if isinstance(dag, CompactDAG) else decode_dag(encode_dag(dag), compact=True)
+
+
+def to_object_dag(dag: DAG) -> DAG:
+    return decode_dag(encode_dag(dag)) if isinstance(dag, CompactDAG) else dag
+
+
+def encode_dag(dag: DAG) -> dict[str, np.ndarray]:
+    if isinstance(dag, CompactDAG):
+        encoder = _ColumnEncoder(lambda x: x.index if isinstance(x, NodeView) and x.dag is dag else None,
+                                 lambda x: x.index if isinstance(x, EdgeView) and x.dag is dag else None)
+        arrays = {
+            'node_coords': dag.node_coords,
+            'edge_nodes': dag.edge_nodes,
+            'node_edge_offsets': dag.node_edge_offsets,
+            'node_edge_ids': dag.node_edge_ids,
+        }
+        python_coords = dag.python_coords
+        root = dag.root_index
+    else:
+        node_index = {id(node): i for i, node in enumerate(dag.nodes)}
+        edge_index = {id(edge): i for i, edge in enumerate(dag.edges)}
+        encoder = _ColumnEncoder(lambda x: node_index.get(id(x), None), lambda x: edge_index.get(id(x), None))
+        arrays = {
+            'node_coords': np.array([node.coords for node in dag.nodes], dtype=np.int64).reshape(-1, 3),
+            'edge_nodes': np.array([(node_index[id(edge.node_a)], node_index[id(edge.node_b)]) for edge in dag.edges],
+                                   dtype=np.int64).reshape(-1, 2),
+            'node_edge_offsets': np.cumsum([0] + [len(node.edges) for node in dag.nodes], dtype=np.int64),
+            'node_edge_ids': np.array([edge_index[id(edge)] for node in dag.nodes for edge in node.edges],
+                                      dtype=np.int64),
+        }
+        python_coords = all(type(x) is int for node in dag.nodes for x in node.coords)
+        root = node_index[id(dag.root)] if dag.root is not None else -1
+
+    schema = {
+        'version': FORMAT_VERSION,
+        'id': dag.id,
+        'root': root,
+        'python_coords': python_coords,
+        'volume_shape': encoder.encode('dag/volume_shape', [dag.volume_shape], arrays),
+        'edge_data': {name: encoder.encode(f'edge_data/{name}', [getattr(edge.edge_data, name) for edge in dag.edges],
+                                           arrays) for name in EDGE_DATA_FIELDS},
+        'node': _encode_data_dicts(encoder, 'node', [node.data for node in dag.nodes], arrays),
+        'edge': _encode_data_dicts(encoder, 'edge', [edge.data for edge in dag.edges], arrays),
+        'dag': {key: encoder.encode(f'dag/data/{key}', [value], arrays) for key, value in dag.data.items()},
+    }
+    arrays[SCHEMA_KEY] = np.array(json.dumps(schema))
+    return arrays
+
+
+def decode_dag(arrays: dict[str, np.ndarray], compact: bool = False) -> DAG:
+    schema = json.loads(str(arrays[SCHEMA_KEY]))
+    if compact:
+        return _decode_compact_dag(arrays, schema)
+    node_coords = arrays['node_coords'].tolist() if schema['python_coords'] else arrays['node_coords']
+    nodes = [Node(coords) for coords in map(tuple, node_coords)]
+    edges = [Edge(nodes[a], nodes[b]) for a, b in arrays['edge_nodes'].tolist()]
+    offsets = arrays['node_edge_offsets'].tolist()
+    node_edge_ids = arrays['node_edge_ids'].tolist()
+    for i, node in enumerate(nodes):
+        node.edges = [edges[x] for x in node_edge_ids[offsets[i]:offsets[i + 1]]]
+
+    decoder = _ColumnDecoder(nodes, edges, arrays)
+    for name, column in schema['edge_data'].items():
+        for edge, value in zip(edges, decoder.decode(f'edge_data/{name}', column, len(edges))):
+            setattr(edge.edge_data, name, value)
+    _decode_data_dicts(decoder, 'node', schema['node'], [node.data for node in nodes])
+    _decode_data_dicts(decoder, 'edge', schema['edge'], [edge.data for edge in edges])
+
+    root = nodes[schema['root']] if schema['root'] >= 0 else None
+    volume_shape = decoder.decode('dag/volume_shape', schema['volume_shape'], 1)[0]
+    dag = DAG(root, volume_shape, nodes, edges)
+    dag.id = schema['id']
+    dag.data = {key: decoder.decode(f'dag/data/{key}', column, 1)[0] for key, column in schema['dag'].items()}
+    return dag
+
+
+def _decode_compact_dag(arrays: dict[str, np.ndarray], schema: dict) -> CompactDAG:
+    dag = CompactDAG(schema['root'], None, arrays['node_coords'], arrays['edge_nodes'], arrays['node_edge_offsets'],
+                     arrays['node_edge_ids'], AttributeStore(len(arrays['edge_nodes'])),
+                     python_coords=schema['python_coords'])
+    decoder = _ColumnDecoder(dag.nodes, dag.edges, arrays)
+    for name, column in schema['edge_data'].items():
+        dag.edge_fields.columns[name] = _decode_attribute_column(decoder, dag, f'edge_data/{name}', column, None,
+                                                                 dag.edge_fields.length)
+    for group, store in [('node', dag.node_attributes), ('edge', dag.edge_attributes)]:
+        for key in schema[group]['keys']:
+            column = schema[group]['columns'][key]
+            present = arrays[f'{group}/{key}/present'] if column.get('sparse', False) else None
+            store.columns[key] = _decode_attribute_column(decoder, dag, f'{group}/{key}', column, present, store.length)
+    dag.volume_shape = decoder.decode('dag/volume_shape', schema['volume_shape'], 1)[0]
+    dag.id = schema['id']
+    dag.data = {key: decoder.decode(f'dag/data/{key}', column, 1)[0] for key, column in schema['dag'].items()}
+    return dag
+
+
+def _decode_attribute_column(decoder, dag: CompactDAG, name: str, column: dict, present: np.ndarray,
+                             length: int) -> Any:
+    arrays = decoder.arrays
+    kind = column['kind']
+    positions = np.arange(length) if present is None else np.flatnonzero(present)
+    nulls = None
+    value_positions = positions
+    if column['null']:
+        nulls = np.zeros(length, dtype=bool)
+        nulls[positions] = arrays[f'{name}/null']
+        value_positions = positions[~arrays[f'{name}/null']]
+    if kind in ['node_ref', 'edge_ref']:
+        indices = np.full(length, -1, dtype=np.int64)
+        indices[value_positions] = arrays[f'{name}/values']
+        return ReferenceColumn(indices, dag.get_node_view if kind == 'node_ref' else dag.get_edge_view, present)
+    if kind in ['scalar', 'string'] and f'{name}/python_types' not in arrays:
+        source = arrays[f'{name}/values']
+        values = np.zeros(length, dtype=source.dtype)
+        values[value_positions] = source
+        return ArrayColumn(values, present, nulls, kind == 'string' or column['python'])
+    if kind in ['array', 'tuple', 'list', 'tuple_list'] and not column['null']:
+        return RaggedColumn(arrays[f'{name}/values'], arrays[f'{name}/offsets'], arrays[f'{name}/shapes'], kind,
+                            present, column.get('python', False))
+    values = [MISSING] * length
+    for position, value in zip(positions.tolist(), decoder.decode(name, column, len(positions))):
+        values[position] = value
+    return ObjectColumn(values)
+
+
+def _encode_data_dicts(encoder, group: str, data_dicts: list[dict], arrays: dict) -> dict:
+    keys = list(dict.fromkeys(key for data in data_dicts for key in data.keys()))
+    columns = {}
+    for key in keys:
+        present = np.array([key in data for data in data_dicts], dtype=bool)
+        values = [data[key] for data in data_dicts if key in data]
+        columns[key] = encoder.encode(f'{group}/{key}', values, arrays)
+        if not present.all():
+            arrays[f'{group}/{key}/present'] = present
+            columns[key]['sparse'] = True
+    return {'keys': keys, 'columns': columns}
+
+
+def _decode_data_dicts(decoder, group: str, schema: dict, data_dicts: list[dict]) -> None:
+    for key in schema['keys']:
+        column = schema['columns'][key]
+        if column.get('sparse', False):
+            targets = [data for data, present in zip(data_dicts, decoder.arrays[f'{group}/{key}/present']) if present]
+        else:
+            targets = data_dicts
+        for data, value in zip(targets, decoder.decode(f'{group}/{key}', column, len(targets))):
+            data[key] = value
+
+
+def _is_scalar(value: Any) -> bool:
+    return isinstance(value, (bool, int, float, np.number, np.bool_))
+
+
+class _ColumnEncoder:
+
+    def __init__(self, get_node_index: Callable[[Any], Optional[int]], get_edge_index: Callable[[Any], Optional[int]]):
+        self.get_node_index = get_node_index
+        self.get_edge_index = get_edge_index
+
+    def encode(self, name: str, values: list, arrays: dict) -> dict:
+        non_null = [x for x in values if x is not None]
+        column = {'null': len(non_null) != len(values)}
+        if column['null']:
+            arrays[f'{name}/null'] = np.array([x is None for x in values], dtype=bool)
+        if len(non_null) == 0:
+            column['kind'] = 'null'
+        elif all(self.get_node_index(x) is not None for x in non_null):
+            column['kind'] = 'node_ref'
+            arrays[f'{name}/values'] = np.array([self.get_node_index(x) for x in non_null], dtype=np.int64)
+        elif all(self.get_edge_index(x) is not None for x in non_null):
+            column['kind'] = 'edge_ref'
+            arrays[f'{name}/values'] = np.array([self.get_edge_index(x) for x in non_null], dtype=np.int64)
+        elif all(_is_scalar(x) for x in non_null):
+            column['kind'] = 'scalar'
+            python_types = np.array([PYTHON_SCALAR_TYPES.index(type(x)) + 1 if type(x) in PYTHON_SCALAR_TYPES else 0
+                                     for x in non_null], dtype=np.int8)
+            column['python'] = bool(python_types.all())
+            if python_types.any() and not column['python']:
+                arrays[f'{name}/python_types'] = python_types
+            arrays[f'{name}/values'] = np.array(non_null)
+        elif all(isinstance(x, str) for x in non_null):
+            column['kind'] = 'string'
+            arrays[f'{name}/values'] = np.array(non_null, dtype=str)
+        elif all(isinstance(x, np.ndarray) and x.dtype != object for x in non_null):
+            column['kind'] = 'array'
+            self.__encode_ragged(name, [np.asarray(x) for x in non_null], arrays)
+        elif all(isinstance(x, (list, tuple)) and all(_is_scalar(y) for y in x) for x in non_null):
+            column['kind'] = 'tuple' if isinstance(non_null[0], tuple) else 'list'
+            column['python'] = not any(isinstance(y, (np.number, np.bool_)) for x in non_null for y in x)
+            self.__encode_ragged(name, [np.array(x) for x in non_null], arrays)
+        elif all(isinstance(x, list) and all(isinstance(y, tuple) and all(_is_scalar(z) for z in y) for y in x)
+                 for x in non_null):
+            column['kind'] = 'tuple_list'
+            column['python'] = not any(isinstance(z, (np.number, np.bool_)) for x in non_null for y in x for z in y)
+            width = next((len(y) for x in non_null for y in x), 0)
+            self.__encode_ragged(name, [np.array(x).reshape(len(x), width) for x in non_null], arrays)
+        else:
+            types = {type(x).__name__ for x in non_null}
+            raise NotImplementedError(f'Cannot store column {name} with values of types {types}')
+        return column
+
+    @staticmethod
+    def __encode_ragged(name: str, values: list[np.ndarray], arrays: dict) -> None:
+        non_empty = [x for x in values if x.size > 0]
+        dtype = np.result_type(*non_empty) if len(non_empty) > 0 else np.result_type(*values)
+        arrays[f'{name}/shapes'] = np.array([x.shape for x in values], dtype=np.int64).reshape(len(values), -1)
+        arrays[f'{name}/offsets'] = np.cumsum([0] + [x.size for x in values], dtype=np.int64)
+        arrays[f'{name}/values'] = np.concatenate([x.ravel() for x in values]).astype(dtype, copy=False)
+
+
+class _ColumnDecoder:
+
+    def __init__(self, nodes: Sequence[Node], edges: Sequence[Edge], arrays: dict[str, np.ndarray]):
+        self.nodes = nodes
+        self.edges = edges
+        self.arrays = arrays
+
+    def decode(self, name: str, column: dict, length: int) -> list:
+        kind = column['kind']
+        if kind == 'null':
+            values = []
+        elif kind == 'node_ref':
+            values = [self.nodes[x] for x in self.arrays[f'{name}/values'].tolist()]
+        elif kind == 'edge_ref':
+            values = [self.edges[x] for x in self.arrays[f'{name}/values'].tolist()]
+        elif kind == 'scalar':
+            array = self.arrays[f'{name}/values']
+            values = array.tolist() if column['python'] else list(array)
+            if f'{name}/python_types' in self.arrays:
+                for i in np.flatnonzero(self.arrays[f'{name}/python_types']).tolist():
+                    values[i] = PYTHON_SCALAR_TYPES[self.arrays[f'{name}/python_types'][i] - 1](values[i])
+        elif kind == 'string':
+            values = self.arrays[f'{name}/values'].tolist()
+        else:
+            values = self.__decode_ragged(name, kind, column.get('python', False))
+        if column['null']:
+            iterator = iter(values)
+            values = [None if is_null else next(iterator) for is_null in self.arrays[f'{name}/null'].tolist()]
+        if len(values) != length:
+            raise IOError(f'Column {name} has {len(values)} values, expected {length}')
+        return values
+
+    def __decode_ragged(self, name: str, kind: str, python: bool) -> list:
+        flat = self.arrays[f'{name}/values']
+        offsets = self.arrays[f'{name}/offsets']
+        shapes = [tuple(x) for x in self.arrays[f'{name}/shapes'].tolist()]
+        blocks = [flat[begin:end].reshape(shape) for begin, end, shape in zip(offsets[:-1], offsets[1:], shapes)]
+        if kind == 'array':
+            return blocks
+        if kind == 'tuple_list':
+            if python:
+                return [list(map(tuple, x.tolist())) for x in blocks]
+            return [list(map(tuple, x)) for x in blocks]
+        values = [x.tolist() if python else list(x) for x in blocks]
+        return [tuple(x) for x in values] if kind == 'tuple' else values
@@ -0,0 +1,71 @@
+import os
+import re
+
+from modules.common.src.app_utils.Logger import get_logger, log_execution
+from modules.common.src.app_utils.Reader import Reader, OutputType, VOLUME_OUTPUT_TYPES, DAG_OUTPUT_TYPES
+
+SIZE_STR_PATTERN = re.compile(r'(_\d+)?(_level(\d+))?')
+
+
+def find_data_files(tree_name: str,
+                    steps: list[Reader.DataStep]) -> list[tuple[Reader.DataStep, str, int, OutputType]]:
+    found = []
+    for file_name in sorted(os.listdir(Reader.DATA_DIR + tree_name)):
+        for step in steps:
+            for output_type in step.get_output_types():
+                prefix, suffix = step.value[0], '.' + output_type.value
+                if not (file_name.startswith(prefix) and file_name.endswith(suffix)):
+                    continue
+                match = SIZE_STR_PATTERN.fullmatch(file_name[len(prefix):len(file_name) - len(suffix)])
+                if match:
+                    level = int(match.group(3)) if match.group(3) else 0
+                    found.append((step, match.group(1) or '', level, output_type))
+    return found
+
+
+def get_reader_for_size_str(tree_name: str, size_str: str, **kwargs) -> Reader:
+    return Reader(tree_name, use_cache=False, default_size=int(size_str[1:]) if size_str else None, **kwargs)
+
+
+@log_execution
+def convert_volumes(output_type: OutputType, dir_names: list[str] = None, steps: list[Reader.DataStep] = None,
+                    remove_source: bool = False) -> None:
+    if output_type not in VOLUME_OUTPUT_TYPES:
+        raise ValueError(f'{output_type} is not an array output type')
+    steps = [x for x in Reader.DataStep if x.is_volume()] if steps is None else steps
+    _convert(output_type, dir_names, steps, remove_source)
+
+
+@log_execution
+def convert_dags(output_type: OutputType, dir_names: list[str] = None, steps: list[Reader.DataStep] = None,
+                 remove_source: bool = False) -> None:
+    if output_type not in DAG_OUTPUT_TYPES:
+        raise ValueError(f'{output_type} is not a DAG output type')
+    steps = [x for x in Reader.DataStep if x.is_dag()] if steps is None else steps
+    _convert(output_type, dir_names, steps, remove_source)
+
+
+def _convert(output_type: OutputType, dir_names: list[str], steps: list[Reader.DataStep], remove_source: bool) -> None:
+    dir_names = Reader.get_all_data_folders() if dir_names is None else dir_names
+    for tree_name in dir_names:
+        for step, size_str, level, source_type in find_data_files(tree_name, steps):
+            if source_type == output_type:
+                continue
+            source = get_reader_for_size_str(tree_name, size_str, **_get_output_kwargs(step, source_type))
+            target = get_reader_for_size_str(tree_name, size_str, force_override=True,
+                                             **_get_output_kwargs(step, output_type))
+            source_name, target_name = source.get_full_name(step, level=level), target.get_full_name(step, level=level)
+            if level > 0 and source.select_level(step, level) != level:
+                get_logger().error(f'Pyramid of {source.get_full_name(step)} does not list level {level}, '
+                                   f'{source_name} is not converted')
+                continue
+            get_logger().info(f'Converting {source_name} to {target_name}')
+            data = source.load_data(step, level=level) if level > 0 else source.load_data(step)
+            target.save_data(data, step, level)
+            del data
+            if remove_source:
+                os.remove(source_name)
+
+
+def _get_output_kwargs(step: Reader.DataStep, output_type: OutputType) -> dict:
+    return {'array_output': output_type} if step.is_volume() else {'dag_output': output_type}
@@ -0,0 +1,139 @@
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+import numpy as np
+
+OBJECT_OVERHEAD = 200
+
+
+def get_data_cache() -> 'DataCache':
+    return DataCache.get_instance()
+
+
+class DataCache:
+    DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+    instance = None
+    instance_lock = threading.Lock()
+
+    @staticmethod
+    def get_instance() -> 'DataCache':
+        with DataCache.instance_lock:
+            if DataCache.instance is None:
+                DataCache.instance = DataCache()
+        return DataCache.instance
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self.__pending: dict[Hashable, Future] = {}
+        self.__current_bytes = 0
+        self.__lock = threading.Lock()
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self.__lock:
+            if key in self.__entries:
+                self.hits += 1
+                self.__entries.move_to_end(key)
+                return self.__entries[key][0]
+            future = self.__pending.get(key, None)
+            is_owner = future is None
+            if is_owner:
+                self.misses += 1
+                future = Future()
+                self.__pending[key] = future
+            else:
+                self.hits += 1
+        if not is_owner:
+            return future.result()
+        try:
+            data = loader()
+        except BaseException as ex:
+            with self.__lock:
+                del self.__pending[key]
+            future.set_exception(ex)
+            raise
+        with self.__lock:
+            del self.__pending[key]
+            if data is not None:
+                self.__put(key, data)
+        future.set_result(data)
+        return data
+
+    def put(self, key: Hashable, data: Any) -> None:
+        with self.__lock:
+            self.__put(key, data)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.__lock:
+            self.__remove(key)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__current_bytes = 0
+
+    def set_max_bytes(self, max_bytes: int) -> None:
+        with self.__lock:
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def get_stats(self) -> dict[str, int]:
+        with self.__lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.__entries), 'bytes': self.__current_bytes, 'max_bytes': self.max_bytes}
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.__lock:
+            return key in self.__entries
+
+    def __put(self, key: Hashable, data: Any) -> None:
+        self.__remove(key)
+        nbytes = estimate_nbytes(data)
+        if nbytes > self.max_bytes:
+            return
+        self.__entries[key] = (data, nbytes)
+        self.__current_bytes += nbytes
+        self.__evict()
+
+    def __remove(self, key: Hashable) -> None:
+        entry = self.__entries.pop(key, None)
+        if entry is not None:
+            self.__current_bytes -= entry[1]
+
+    def __evict(self) -> None:
+        while self.__current_bytes > self.max_bytes and len(self.__entries) > 0:
+            _, (_, nbytes) = self.__entries.popitem(last=False)
+            self.__current_bytes -= nbytes
+            self.evictions += 1
+
+
+def estimate_nbytes(data: Any) -> int:
+    if isinstance(data, np.ndarray):
+        return 0 if _is_memory_mapped(data) else data.nbytes
+    if hasattr(data, 'nbytes'):
+        return data.nbytes
+    if hasattr(data, 'nodes') and hasattr(data, 'edges'):
+        return (OBJECT_OVERHEAD + _estimate_dict_nbytes(data.data)
+                + sum(OBJECT_OVERHEAD + _estimate_dict_nbytes(node.data) for node in data.nodes)
+                + sum(OBJECT_OVERHEAD + _estimate_dict_nbytes(edge.data) for edge in data.edges))
+    if isinstance(data, (list, tuple)):
+        return sys.getsizeof(data) + (len(data) * estimate_nbytes(data[0]) if len(data) > 0 else 0)
+    return sys.getsizeof(data)
+
+
+def _estimate_dict_nbytes(data: dict) -> int:
+    return sys.getsizeof(data) + sum(estimate_nbytes(x) for x in data.values() if not hasattr(x, 'edges'))
+
+
+def _is_memory_mapped(array: np.ndarray) -> bool:
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base if isinstance(array.base, np.ndarray) else None
+    return False
@@ -0,0 +1,144 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from copy import deepcopy
+from typing import Any, Union
+
+import numpy as np
+
+from modules.common.src.app_utils.Logger import get_logger, log_execution
+from modules.common.src.app_utils.Reader import Reader
+from modules.common.src.model.AttributeStore import ArrayColumn, RaggedColumn
+from modules.common.src.model.CompactDAG import CompactDAG
+from modules.common.src.model.DAG import DAG
+from modules.common.src.model.PackedPaths import get_packed_paths
+
+DEFAULT_DIRECTION_WINDOW = 5
+MAX_GENERATION = 9
+EDGE_DATA_STATISTICS = {'length': 'length', 'end_to_end_length': 'end_to_end_length', 'thickness': 'mean_thickness',
+                        'relative_angle': 'relative_angle', 'generation': 'generation'}
+EDGE_STATISTICS = ['length', 'end_to_end_length', 'mean_thickness', 'tortuosity', 'start_direction', 'end_direction',
+                   'relative_angle', 'depth']
+
+
+def compute_edge_statistics(dag: DAG, radii: Any, direction_window: int = DEFAULT_DIRECTION_WINDOW) -> dict[str, Any]:
+    paths, path_offsets, voxel_counts = get_packed_paths(dag)
+    starts, stops = path_offsets[:-1], path_offsets[1:]
+    # Length is the arc length of the polyline node_a, voxels..., node_b, i.e. the unsmoothed centre line
+    steps = np.linalg.norm(np.diff(paths, axis=0), axis=1)
+    cumulative = np.concatenate([[0], np.cumsum(steps)])
+    length = cumulative[stops - 1] - cumulative[starts]
+    end_to_end_length = np.linalg.norm(paths[stops - 1] - paths[starts], axis=1)
+
+    sampled = np.ones(len(paths), dtype=bool)
+    sampled[starts[voxel_counts > 0]] = False
+    sampled[stops[voxel_counts > 0] - 1] = False
+    samples = _sample_volume(radii, paths[sampled])
+    sample_offsets = np.concatenate([[0], np.cumsum(np.where(voxel_counts > 0, voxel_counts, 2))]).astype(np.int64)
+    sample_sums = np.concatenate([[0], np.cumsum(samples, dtype=np.float64)])
+    mean_thickness = (sample_sums[sample_offsets[1:]] - sample_sums[sample_offsets[:-1]]) / np.diff(sample_offsets)
+
+    window = np.minimum(direction_window, stops - starts - 1)
+    start_direction = _normalize(paths[starts + window] - paths[starts])
+    end_direction = _normalize(paths[stops - 1] - paths[stops - 1 - window])
+
+    traversal = dag.get_traversal()
+    parent_edges = np.full(len(starts), -1, dtype=np.int64)
+    depth = np.zeros(len(starts), dtype=np.int64)
+    parent_edges[traversal.edges] = traversal.parent_edges
+    depth[traversal.edges] = traversal.depths
+    # Keep generations assigned by the dag pipeline, if there are none use the depth capped at MAX_GENERATION
+    stored_generation = np.nan_to_num(np.asarray(dag.get_adjacency().generations, dtype=np.float64)).astype(np.int64)
+    generation = stored_generation if np.any(stored_generation > 0) else np.minimum(depth, MAX_GENERATION)
+    has_parent = parent_edges >= 0
+    relative_angle = np.full(len(starts), np.nan)
+    cosines = np.sum(end_direction[parent_edges[has_parent]] * start_direction[has_parent], axis=1)
+    relative_angle[has_parent] = np.arccos(np.clip(cosines, -1, 1))
+
+    return {
+        'length': length,
+        'end_to_end_length': end_to_end_length,
+        'mean_thickness': mean_thickness,
+        'thickness_list': (samples, sample_offsets),
+        'tortuosity': np.divide(length, end_to_end_length, out=np.full(len(length), np.nan),
+                                where=end_to_end_length > 0),
+        'start_direction': start_direction,
+        'end_direction': end_direction,
+        'relative_angle': relative_angle,
+        'generation': generation,
+        'depth': depth,
+    }
+
+
+def add_edge_statistics(dag: DAG, radii: Any, direction_window: int = DEFAULT_DIRECTION_WINDOW) -> DAG:
+    statistics = compute_edge_statistics(dag, radii, direction_window)
+    samples, sample_offsets = statistics['thickness_list']
+    nulls = np.isnan(statistics['relative_angle'])
+    if isinstance(dag, CompactDAG):
+        for field, name in EDGE_DATA_STATISTICS.items():
+            dag.edge_fields.columns[field] = ArrayColumn(statistics[name].copy(),
+                                                         nulls=nulls.copy() if name == 'relative_angle' else None)
+        for name in EDGE_STATISTICS:
+            dag.edge_attributes.columns[name] = ArrayColumn(statistics[name], nulls=nulls if name == 'relative_angle'
+                                                            else None)
+        dag.edge_attributes.columns['thickness_list'] = RaggedColumn(samples, sample_offsets,
+                                                                     np.diff(sample_offsets).reshape(-1, 1))
+        dag.invalidate()
+        return dag
+    columns = {name: statistics[name].tolist() if statistics[name].ndim == 1 else list(statistics[name])
+               for name in set(EDGE_STATISTICS) | set(EDGE_DATA_STATISTICS.values())}
+    for i, edge in enumerate(dag.edges):
+        values = {name: column[i] for name, column in columns.items()}
+        if nulls[i]:
+            values['relative_angle'] = None
+        for field, name in EDGE_DATA_STATISTICS.items():
+            setattr(edge.edge_data, field, values[name])
+        for name in EDGE_STATISTICS:
+            edge.data[name] = values[name]
+        edge.data['thickness_list'] = samples[sample_offsets[i]:sample_offsets[i + 1]]
+    dag.invalidate()
+    return dag
+
+
+@log_execution
+def build_dag_with_stats(reader: Reader, direction_window: int = DEFAULT_DIRECTION_WINDOW,
+                         save: bool = True) -> Union[DAG, None]:
+    dag = reader.load_data(Reader.DataStep.DAG_FILENAME)
+    radii = reader.load_data(Reader.DataStep.SKELETON_THICKNESS_FILENAME)
+    if dag is None or radii is None:
+        get_logger().error(f'Statistics for {reader.tree_name} cannot be computed without dag and central line radii')
+        return None
+    dag = add_edge_statistics(deepcopy(dag), radii, direction_window)
+    if save:
+        reader.save_data(dag, Reader.DataStep.DAG_WITH_STATS_FILENAME)
+        reader.flush()
+    return dag
+
+
+@log_execution
+def build_cohort_dags_with_stats(dir_names: list[str] = None, dir_type: Reader.DirType = None,
+                                 direction_window: int = DEFAULT_DIRECTION_WINDOW, workers: int = None,
+                                 use_processes: bool = True, force_override: bool = False) -> list[str]:
+    if dir_names is None:
+        dir_names = Reader.get_all_data_folders() if dir_type is None else Reader.filter_data_folders_by_type(dir_type)
+    readers = [Reader(x, force_override=force_override, use_cache=False) for x in sorted(dir_names)]
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=os.cpu_count() if workers is None else workers) as executor:
+        futures = [executor.submit(_build_case, x, direction_window, Reader.DATA_DIR) for x in readers]
+        return [x.result() for x in futures if x.result() is not None]
+
+
+def _build_case(reader: Reader, direction_window: int, data_dir: str) -> Union[str, None]:
+    Reader.DATA_DIR = data_dir
+    return reader.tree_name if build_dag_with_stats(reader, direction_window) is not None else None
+
+
+def _sample_volume(volume: Any, coords: np.ndarray) -> np.ndarray:
+    coords = np.clip(coords, 0, np.array(volume.shape) - 1)
+    if hasattr(volume, 'lookup'):
+        return volume.lookup(coords)
+    return np.asarray(volume[tuple(coords.T)])
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros(vectors.shape), where=norms > 0)
@@ -0,0 +1,155 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+from enum import Enum
+from typing import Any, Callable, Union
+
+import numpy as np
+
+from modules.common.src.app_utils.Logger import get_logger
+from modules.common.src.app_utils.Reader import Reader, write_atomically
+
+Product = Union[np.ndarray, list[np.ndarray], tuple[np.ndarray, ...]]
+
+HASH_BLOCK_SIZE = 1024 * 1024
+PRODUCT_TYPE_KEY = 'type'
+
+
+class ProductCache:
+    DIR_NAME = '.products'
+    SOURCE_HASHES_FILENAME = 'source_hashes.json'
+    DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+    lock = threading.Lock()
+
+    def __init__(self, reader: Reader, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.__reader = reader
+        self.max_bytes = max_bytes
+        self.products_dir = os.path.join(Reader.DATA_DIR, reader.tree_name, ProductCache.DIR_NAME)
+
+    def get_or_compute(self, step: Reader.DataStep, function: Callable[..., Product], *args, **kwargs) -> Product:
+        exists, full_name = self.__reader.datafile_exists(step)
+        if not exists:
+            get_logger().error(f'Requested file {full_name} does not exist, product cannot be computed')
+            return None
+        prefix = f'{function.__name__}-{_hash_parameters(function, args, kwargs)}-'
+        product_name = os.path.join(self.products_dir, prefix + self.__get_source_hash(full_name) + '.npz')
+        if os.path.exists(product_name):
+            get_logger().debug(f'Reusing product {product_name}')
+            os.utime(product_name)
+            return _load_product(product_name)
+        product = function(self.__reader.load_data(step), *args, **kwargs)
+        with ProductCache.lock:
+            for outdated_name in glob.glob(os.path.join(glob.escape(self.products_dir), glob.escape(prefix) + '*.npz')):
+                os.remove(outdated_name)
+            _save_product(product_name, product)
+            self.__evict()
+        return product
+
+    def clear(self) -> None:
+        with ProductCache.lock:
+            for product_name in self.__get_product_names():
+                os.remove(product_name)
+
+    def __get_product_names(self) -> list[str]:
+        return glob.glob(os.path.join(glob.escape(self.products_dir), '*.npz'))
+
+    def __evict(self) -> None:
+        products = sorted((os.stat(x).st_mtime_ns, os.path.getsize(x), x) for x in self.__get_product_names())
+        total_size = sum(x[1] for x in products)
+        for _, size, product_name in products:
+            if total_size <= self.max_bytes:
+                break
+            get_logger().debug(f'Evicting product {product_name}')
+            os.remove(product_name)
+            total_size -= size
+
+    def __get_source_hash(self, full_name: str) -> str:
+        hashes_name = os.path.join(self.products_dir, ProductCache.SOURCE_HASHES_FILENAME)
+        stat = os.stat(full_name)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        with ProductCache.lock:
+            entry = _read_source_hashes(hashes_name).get(os.path.basename(full_name), None)
+            if entry is not None and entry['signature'] == signature:
+                return entry['hash']
+            content_hash = hashlib.sha256()
+            with open(full_name, 'rb') as input_:
+                for block in iter(lambda: input_.read(HASH_BLOCK_SIZE), b''):
+                    content_hash.update(block)
+            entry = {'signature': signature, 'hash': content_hash.hexdigest()[:16]}
+            # Re-read right before the atomic replace, so entries written meanwhile by other workers are kept
+            hashes = _read_source_hashes(hashes_name)
+            hashes[os.path.basename(full_name)] = entry
+            os.makedirs(self.products_dir, exist_ok=True)
+            write_atomically(hashes_name, lambda output: output.write(json.dumps(hashes).encode()))
+            return entry['hash']
+
+
+def _read_source_hashes(hashes_name: str) -> dict[str, Any]:
+    if not os.path.exists(hashes_name):
+        return {}
+    try:
+        with open(hashes_name) as input_:
+            return json.load(input_)
+    except ValueError:
+        get_logger().warning(f'Source hashes {hashes_name} are not readable and will be recomputed')
+        return {}
+
+
+def _save_product(product_name: str, product: Product) -> None:
+    if isinstance(product, np.ndarray):
+        arrays = {'result': product}
+    elif isinstance(product, (list, tuple)) and all(isinstance(x, np.ndarray) for x in product):
+        arrays = {f'{type(product).__name__}_{i}': x for i, x in enumerate(product)}
+        arrays[PRODUCT_TYPE_KEY] = np.array(type(product).__name__)
+    else:
+        raise NotImplementedError(f'Products of type {type(product).__name__} cannot be stored')
+    os.makedirs(os.path.dirname(product_name), exist_ok=True)
+    write_atomically(product_name,
+                     lambda output: np.savez(output, **{name: np.asarray(x) for name, x in arrays.items()}))
+
+
+def _load_product(product_name: str) -> Product:
+    with np.load(product_name, allow_pickle=False) as input_:
+        if 'result' in input_.files:
+            return input_['result']
+        names = sorted((x for x in input_.files if x != PRODUCT_TYPE_KEY), key=lambda x: int(x.rsplit('_', 1)[1]))
+        items = [input_[name] for name in names]
+        if PRODUCT_TYPE_KEY in input_.files:
+            product_type = str(input_[PRODUCT_TYPE_KEY])
+        else:
+            product_type = names[0].rsplit('_', 1)[0] if len(names) > 0 else 'list'
+    return tuple(items) if product_type == 'tuple' else items
+
+
+def _hash_parameters(function: Callable, args: tuple, kwargs: dict) -> str:
+    parameters_hash = hashlib.sha256(f'{function.__module__}.{function.__qualname__}'.encode())
+    for value in list(args) + sorted(kwargs.items()):
+        _update_hash(parameters_hash, value)
+    return parameters_hash.hexdigest()[:16]
+
+
+def _update_hash(parameters_hash: Any, value: Any) -> None:
+    if isinstance(value, np.ndarray):
+        parameters_hash.update(f'{value.dtype.str}{value.shape}'.encode())
+        parameters_hash.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        parameters_hash.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            _update_hash(parameters_hash, item)
+    elif isinstance(value, dict):
+        _update_hash(parameters_hash, sorted(value.items()))
+    elif hasattr(value, 'node_a') and hasattr(value, 'node_b'):
+        _update_hash(parameters_hash, (value.node_a.coords, value.node_b.coords))
+    elif hasattr(value, 'coords'):
+        _update_hash(parameters_hash, value.coords)
+    elif isinstance(value, Enum):
+        parameters_hash.update(f'{type(value).__qualname__}.{value.name}'.encode())
+    elif value is None or isinstance(value, (bool, int, float, str, bytes, np.generic)):
+        parameters_hash.update(f'{type(value).__name__}:{value!r}'.encode())
+    elif callable(value) and '<' not in getattr(value, '__qualname__', '<'):
+        parameters_hash.update(f'{value.__module__}.{value.__qualname__}'.encode())
+    else:
+        raise TypeError(f'Parameter of type {type(value).__name__} has no stable fingerprint and cannot be part of '
+                        f'a product cache key')
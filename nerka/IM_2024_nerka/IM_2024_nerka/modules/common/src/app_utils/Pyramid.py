@@ -0,0 +1,71 @@
+import json
+import os
+from enum import Enum
+from typing import Optional
+
+import numpy as np
+
+PYRAMID_SUFFIX = '_pyramid.json'
+
+
+class Pooling(Enum):
+    MAX = 'max'
+    MEAN = 'mean'
+
+
+def get_level_size_str(size_str: str, level: int) -> str:
+    return size_str if level == 0 else f'{size_str}_level{level}'
+
+
+def get_default_pooling(volume: np.ndarray) -> Pooling:
+    if volume.dtype == bool or volume.size == 0:
+        return Pooling.MAX
+    if np.issubdtype(volume.dtype, np.integer) and volume.min() >= 0 and volume.max() <= 1:
+        return Pooling.MAX
+    return Pooling.MEAN
+
+
+def downsample(volume: np.ndarray, pooling: Pooling) -> np.ndarray:
+    volume = np.asarray(volume)
+    padding = [(0, size % 2) for size in volume.shape]
+    if any(x[1] for x in padding):
+        volume = np.pad(volume, padding, mode='edge')
+    blocks_shape = [x for size in volume.shape for x in (size // 2, 2)]
+    blocks = volume.reshape(blocks_shape)
+    block_axes = tuple(range(1, len(blocks_shape), 2))
+    if pooling == Pooling.MAX:
+        return blocks.max(axis=block_axes)
+    mean = blocks.mean(axis=block_axes)
+    if np.issubdtype(volume.dtype, np.integer) or volume.dtype == bool:
+        mean = np.rint(mean)
+    return mean.astype(volume.dtype)
+
+
+def select_level(level_shapes: dict[int, tuple], level: int = None, max_voxels: int = None) -> int:
+    levels = sorted(level_shapes.keys())
+    if max_voxels is not None:
+        fitting = [x for x in levels if np.prod(level_shapes[x]) <= max_voxels]
+        return fitting[0] if len(fitting) > 0 else levels[-1]
+    if level is not None:
+        coarser = [x for x in levels if x >= level]
+        return coarser[0] if len(coarser) > 0 else levels[-1]
+    return levels[0]
+
+
+def get_pyramid_name(base_full_name: str) -> str:
+    return os.path.splitext(base_full_name)[0] + PYRAMID_SUFFIX
+
+
+def save_pyramid_metadata(base_full_name: str, level_shapes: dict[int, tuple], pooling: Pooling) -> None:
+    temp_name = get_pyramid_name(base_full_name) + '.tmp'
+    with open(temp_name, 'w') as output:
+        json.dump({'levels': {str(x): y for x, y in level_shapes.items()}, 'pooling': pooling.value}, output)
+    os.replace(temp_name, get_pyramid_name(base_full_name))
+
+
+def load_pyramid_metadata(base_full_name: str) -> Optional[dict[int, tuple]]:
+    if not os.path.exists(get_pyramid_name(base_full_name)):
+        return None
+    with open(get_pyramid_name(base_full_name)) as input_:
+        metadata = json.load(input_)
+    return {int(x): tuple(y) for x, y in metadata['levels'].items()}
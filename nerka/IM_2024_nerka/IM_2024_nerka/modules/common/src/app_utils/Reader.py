@@ -1,13 +1,21 @@
 import os
 import pickle
-import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import Enum
-from typing import Union, Optional, Any
+from typing import Union, Optional, Any, BinaryIO, Callable
 
 import numpy as np
 
+from modules.common.src.app_utils.ChunkedVolume import BBox, ChunkedVolume, save_chunked, clip_bbox, bbox_to_slices, \
+    CODECS, DEFAULT_CODEC, DEFAULT_COMPRESSION_LEVEL
+from modules.common.src.app_utils.ColumnarDAG import save_columnar_dag, load_columnar_dag, to_compact_dag, encode_dag
+from modules.common.src.app_utils.DataCache import get_data_cache
 from modules.common.src.app_utils.Logger import get_logger, log_execution
+from modules.common.src.app_utils.Pyramid import Pooling, downsample, get_default_pooling, get_level_size_str, \
+    select_level, save_pyramid_metadata, load_pyramid_metadata
 from modules.common.src.model import DAG
+from modules.common.src.model.SparseVolume import SparseVolume
 from modules.common.src.model.VolumeData import VolumeData
 
 FIGURE_DIR = '../results/figures/'
@@ -16,10 +24,21 @@ FIGURE_DIR = '../results/figures/'
 class OutputType(Enum):
     DAG_OUTPUT = "pkl"
     ARRAY_OUTPUT = "npz"
+    MEMMAP_OUTPUT = "npy"
+    CHUNKED_OUTPUT = "cvol"
+    COLUMNAR_DAG_OUTPUT = "cdag"
+    SPARSE_OUTPUT = "spv"
+
+
+DAG_OUTPUT_TYPES = [OutputType.DAG_OUTPUT, OutputType.COLUMNAR_DAG_OUTPUT]
+VOLUME_OUTPUT_TYPES = [OutputType.ARRAY_OUTPUT, OutputType.MEMMAP_OUTPUT, OutputType.CHUNKED_OUTPUT,
+                       OutputType.SPARSE_OUTPUT]
 
 
 class Reader:
     DATA_DIR = './data/numpy/'
+    save_executor = None
+    save_executor_lock = threading.Lock()
 
     class DataStep(Enum):
 
@@ -36,8 +55,12 @@ class Reader:
         REGISTERED_ZOOMED = ('RegisteredZoomed', OutputType.ARRAY_OUTPUT)
         ROOT_FILENAME = ('root', OutputType.ARRAY_OUTPUT)
 
-        def get_name(self, size_str: str = '') -> str:
-            return self.value[0] + size_str + "." + self.value[1].value
+        def get_name(self, size_str: str = '', output_type: OutputType = None) -> str:
+            output_type = self.value[1] if output_type is None else output_type
+            return self.value[0] + size_str + "." + output_type.value
+
+        def get_output_types(self) -> list[OutputType]:
+            return DAG_OUTPUT_TYPES if self.is_dag() else VOLUME_OUTPUT_TYPES
 
         def is_dag(self) -> bool:
             return self.value[1] == OutputType.DAG_OUTPUT
@@ -45,17 +68,48 @@ class Reader:
         def is_volume(self) -> bool:
             return self.value[1] == OutputType.ARRAY_OUTPUT
 
+        def is_skeleton(self) -> bool:
+            return self in SKELETON_STEPS
+
     class DirType(Enum):
         DIR_TYPE_GENERATED = 'G'
         DIR_TYPE_MODEL = 'M'
         DIR_TYPE_SPECIMEN = 'P'
 
-    def __init__(self, tree_name: str, force_override: bool = False, use_cache: bool = True, default_size: int = None):
+    def __init__(self, tree_name: str, force_override: bool = False, use_cache: bool = True, default_size: int = None,
+                 array_output: OutputType = OutputType.ARRAY_OUTPUT, dag_output: OutputType = OutputType.DAG_OUTPUT,
+                 codec: str = DEFAULT_CODEC, compression_level: int = DEFAULT_COMPRESSION_LEVEL, async_save: bool = False,
+                 sparse_skeletons: bool = False, compact_dags: bool = False):
+        if array_output not in VOLUME_OUTPUT_TYPES:
+            raise ValueError(f'{array_output} is not an array output type')
+        if dag_output not in DAG_OUTPUT_TYPES:
+            raise ValueError(f'{dag_output} is not a DAG output type')
+        if codec not in CODECS:
+            raise ValueError(f'Unknown codec {codec}, available codecs: {list(CODECS.keys())}')
         self.__force_override = force_override
         self.tree_name = tree_name
-        self.__cache = {}
         self.__use_cache = use_cache
         self.__size_string = "" if default_size in [0, None] else f'_{default_size}'
+        self.__array_output = array_output
+        self.__dag_output = dag_output
+        self.__codec = codec
+        self.__compression_level = compression_level
+        self.__async_save = async_save
+        self.__sparse_skeletons = sparse_skeletons
+        self.__compact_dags = compact_dags
+        self.__pending_saves: list[Future] = []
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_Reader__pending_saves'] = []
+        return state
+
+    @staticmethod
+    def get_save_executor() -> ThreadPoolExecutor:
+        with Reader.save_executor_lock:
+            if Reader.save_executor is None:
+                Reader.save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ReaderWriteBehind')
+        return Reader.save_executor
 
     @staticmethod
     def get_all_data_folders() -> list[str]:
@@ -71,36 +125,101 @@ class Reader:
     def set_force_override(self, p_force_override) -> None:
         self.__force_override = p_force_override
 
-    def save_data(self, data: Union[VolumeData, DAG.DAG], filename: DataStep) -> None:
-        if isinstance(data, DAG.DAG):
+    def get_cache_key(self, filename: DataStep, level: int = 0, compact: bool = None,
+                      output_type: OutputType = None) -> tuple:
+        compact = self.__compact_dags if compact is None else compact
+        output_type = self.get_output_type(filename) if output_type is None else output_type
+        representation = 'compact' if filename.is_dag() and compact else ''
+        return os.path.abspath(self.DATA_DIR), self.tree_name, filename, \
+            get_level_size_str(self.__size_string, level), output_type, representation
+
+    def __invalidate(self, filename: DataStep, level: int = 0) -> None:
+        for output_type in filename.get_output_types():
+            for compact in (False, True):
+                get_data_cache().invalidate(self.get_cache_key(filename, level, compact, output_type))
+
+    def save_data(self, data: Union[VolumeData, DAG.DAG], filename: DataStep, level: int = 0) -> None:
+        self.__invalidate(filename, level)
+        if isinstance(data, DAG.DAG) and level == 0:
             self.__save_dag(data, filename)
-        elif isinstance(data, VolumeData) or isinstance(data, np.ndarray):
-            self.__save_step(data, filename)
+        elif isinstance(data, VolumeData) or isinstance(data, np.ndarray) or isinstance(data, SparseVolume):
+            self.__save_step(data, filename, level)
         else:
             raise NotImplementedError
 
+    def flush(self) -> None:
+        pending_saves, self.__pending_saves = self.__pending_saves, []
+        exceptions = [x.exception() for x in pending_saves if x.exception() is not None]
+        if len(exceptions) > 0:
+            raise exceptions[0]
+
     @log_execution
-    def load_data(self, filename: DataStep) -> Union[VolumeData, DAG.DAG]:
-        data = self.__cache.get(filename, None)
-        if data is None:
-            if filename.is_dag():
-                data = self.__load_dag(filename)
-            elif filename.is_volume():
-                data = self.__load_step(filename)
-            if self.__use_cache:
-                self.__cache[filename] = data
+    def load_data(self, filename: DataStep, bbox: BBox = None, level: int = None,
+                  max_voxels: int = None) -> Union[VolumeData, DAG.DAG]:
+        if (bbox is not None or level is not None or max_voxels is not None) and not filename.is_volume():
+            raise ValueError(f'Bounding box and pyramid level can be used only with volume steps, got {filename}')
+        level = self.select_level(filename, level, max_voxels) if filename.is_volume() else 0
+        if bbox is not None:
+            scale = 2 ** level
+            bbox = tuple(x // scale for x in bbox[0]), tuple(-(-x // scale) for x in bbox[1])
+            return self.__load_step(filename, bbox, level)
+        if self.__use_cache:
+            data = get_data_cache().get_or_load(self.get_cache_key(filename, level),
+                                                lambda: self.__load(filename, level))
+        else:
+            data = self.__load(filename, level)
         if data is None:
             get_logger().warning(f'No data file found: {self.tree_name}/{filename.get_name()}')
         return data
 
+    def __load(self, filename: DataStep, level: int = 0) -> Union[VolumeData, DAG.DAG, None]:
+        if filename.is_dag():
+            return self.__load_dag(filename)
+        elif filename.is_volume():
+            return self.__load_step(filename, level=level)
+        return None
+
+    def select_level(self, filename: DataStep, level: int = None, max_voxels: int = None) -> int:
+        if level is None and max_voxels is None:
+            return 0
+        level_shapes = load_pyramid_metadata(self.get_full_name(filename))
+        if level_shapes is None:
+            get_logger().warning(f'No pyramid built for {self.tree_name}/{filename.get_name()}, using full resolution')
+            return 0
+        return select_level(level_shapes, level, max_voxels)
+
+    @log_execution
+    def build_pyramid(self, filename: DataStep, levels: int = 3, pooling: Pooling = None) -> dict[int, tuple]:
+        data = self.load_data(filename)
+        if data is None:
+            raise IOError(f'Cannot build pyramid, no data file found: {self.tree_name}/{filename.get_name()}')
+        if pooling is None:
+            pooling = Pooling.MAX if filename.is_skeleton() else get_default_pooling(data)
+        level_shapes = {0: data.shape}
+        for level in range(1, levels + 1):
+            data = downsample(data, pooling)
+            self.save_data(data, filename, level)
+            level_shapes[level] = data.shape
+            if max(data.shape) <= 1:
+                break
+        self.flush()
+        save_pyramid_metadata(self.get_full_name(filename), level_shapes, pooling)
+        return level_shapes
+
     def dump(self, data: any, filename: str) -> None:
         pickle.dump(data, open(self.__get_full_dir(), 'wb'))
 
     def __get_full_dir(self):
         return self.DATA_DIR + self.tree_name + '/'
 
-    def get_full_name(self, filename: DataStep) -> str:
-        return self.__get_full_dir() + filename.get_name(self.__size_string)
+    def get_output_type(self, filename: DataStep) -> OutputType:
+        if filename.is_skeleton() and self.__sparse_skeletons:
+            return OutputType.SPARSE_OUTPUT
+        return self.__array_output if filename.is_volume() else self.__dag_output
+
+    def get_full_name(self, filename: DataStep, output_type: OutputType = None, level: int = 0) -> str:
+        output_type = self.get_output_type(filename) if output_type is None else output_type
+        return self.__get_full_dir() + filename.get_name(get_level_size_str(self.__size_string, level), output_type)
 
     def __raise_exception_if_exist_and_should_not_be_overwritten(self, full_name):
         if os.path.exists(full_name) and (not self.__force_override):
@@ -108,52 +227,146 @@ class Reader:
                 f'File {full_name} already exists, use force_override=True if file should be overwritten')
             raise IOError(f'File {full_name} already exists')
 
-    def __save_step(self, data: Union[VolumeData, np.ndarray], filename: DataStep) -> None:
-        full_name = self.get_full_name(filename)
+    def __save_step(self, data: Union[VolumeData, np.ndarray, SparseVolume], filename: DataStep, level: int = 0) -> None:
+        full_name = self.get_full_name(filename, level=level)
         self.__raise_exception_if_exist_and_should_not_be_overwritten(full_name)
+        if self.__async_save and isinstance(data, SparseVolume):
+            data = SparseVolume(data.shape, data.coords.copy(), data.values.copy())
+        elif self.__async_save:
+            data = np.array(data, copy=True)
+        if self.get_output_type(filename) == OutputType.SPARSE_OUTPUT:
+            sparse = data if isinstance(data, SparseVolume) else SparseVolume.from_dense(data)
+            coords_dtype = np.min_scalar_type(max(sparse.shape))
+
+            def write(output: BinaryIO) -> None:
+                np.savez_compressed(output, shape=np.array(sparse.shape), coords=sparse.coords.astype(coords_dtype),
+                                    values=sparse.values)
+        elif self.get_output_type(filename) == OutputType.MEMMAP_OUTPUT:
+            def write(output: BinaryIO) -> None: np.save(output, np.asarray(data))
+        elif self.get_output_type(filename) == OutputType.CHUNKED_OUTPUT:
+            def write(output: BinaryIO) -> None:
+                save_chunked(output, data, codec=self.__codec, level=self.__compression_level)
+        else:
+            def write(output: BinaryIO) -> None: np.savez_compressed(output, data=data)
+        self.__write(full_name, filename, write, level)
+
+    def __write(self, full_name: str, filename: DataStep, write: Callable[[BinaryIO], None], level: int = 0) -> None:
+        if self.__async_save:
+            self.__pending_saves.append(
+                Reader.get_save_executor().submit(self.__write_atomically, full_name, filename, write, level))
+        else:
+            self.__write_atomically(full_name, filename, write, level)
+
+    def __write_atomically(self, full_name: str, filename: DataStep, write: Callable[[BinaryIO], None],
+                           level: int = 0) -> None:
         get_logger().debug(f'Saving {full_name}')
-        np.savez_compressed(full_name, data=data)
+        try:
+            write_atomically(full_name, write)
+        except BaseException as ex:
+            get_logger().error(f'Saving {full_name} failed: {ex}')
+            raise
+        finally:
+            self.__invalidate(filename, level)
         get_logger().debug(f'{full_name} saved successfully')
 
-    def __load_step(self, name: DataStep) -> Optional[VolumeData]:
-        exists, full_name = self.datafile_exists(name)
+    def __load_step(self, name: DataStep, bbox: BBox = None, level: int = 0) -> Optional[VolumeData]:
+        exists, full_name = self.datafile_exists(name, level)
         if not exists:
             get_logger().error(f'Requested file {full_name} does not exist')
             return None
         get_logger().debug(f'Loading {full_name}')
-        if full_name[-1] == 'z':
+        if full_name.endswith(OutputType.SPARSE_OUTPUT.value):
+            with np.load(full_name) as input_:
+                data = SparseVolume(tuple(input_['shape']), input_['coords'], input_['values'])
+        elif full_name.endswith(OutputType.CHUNKED_OUTPUT.value):
+            data: VolumeData = ChunkedVolume(full_name).read(bbox).view(VolumeData)
+            bbox = None
+        elif full_name.endswith(OutputType.MEMMAP_OUTPUT.value):
+            data: VolumeData = np.load(full_name, mmap_mode='c').view(VolumeData)
+        elif full_name[-1] == 'z':
             data: VolumeData = np.load(full_name)['data']
         else:
             data: VolumeData = np.load(full_name)
+        if bbox is not None:
+            data = data[bbox_to_slices(clip_bbox(bbox, data.shape))]
         get_logger().debug(f'{full_name} loaded successfully')
         return data
 
     def __save_dag(self, dag: DAG.DAG, filename: DataStep):
         full_name = self.get_full_name(filename)
-        get_logger().debug(f'Saving dag {full_name}')
         self.__raise_exception_if_exist_and_should_not_be_overwritten(full_name)
-        dag.save(full_name)
-        get_logger().debug(f'Dag {full_name} saved')
+        # Asynchronous saves serialize up front, so later changes of the caller do not leak into the file
+        if self.get_output_type(filename) == OutputType.COLUMNAR_DAG_OUTPUT and self.__async_save:
+            arrays = {key: np.array(value, copy=True) for key, value in encode_dag(dag).items()}
 
-    def __load_dag(self, filename: DataStep) -> DAG.DAG:
-        sys.path.append('./modules/common/src/')
-        sys.modules['DAG'] = DAG
-        with open(self.get_full_name(filename), 'rb') as input_:
-            dag = pickle.load(input_)
-            return dag
+            def write(output: BinaryIO) -> None: np.savez(output, **arrays)
+        elif self.get_output_type(filename) == OutputType.COLUMNAR_DAG_OUTPUT:
+            def write(output: BinaryIO) -> None: save_columnar_dag(output, dag)
+        elif self.__async_save:
+            payload = pickle.dumps(dag)
 
-    def datafile_exists(self, filename: DataStep):
-        full_name = self.get_full_name(filename)
-        return os.path.exists(full_name), full_name
+            def write(output: BinaryIO) -> None: output.write(payload)
+        else:
+            def write(output: BinaryIO) -> None: pickle.dump(dag, output)
+        self.__write(full_name, filename, write)
+
+    def __load_dag(self, filename: DataStep) -> Optional[DAG.DAG]:
+        exists, full_name = self.datafile_exists(filename)
+        if not exists:
+            get_logger().error(f'Requested file {full_name} does not exist')
+            return None
+        if full_name.endswith(OutputType.COLUMNAR_DAG_OUTPUT.value):
+            return load_columnar_dag(full_name, compact=self.__compact_dags)
+        with open(full_name, 'rb') as input_:
+            dag = _ModelUnpickler(input_).load()
+            return to_compact_dag(dag) if self.__compact_dags else dag
+
+    def datafile_exists(self, filename: DataStep, level: int = 0):
+        output_types = [self.get_output_type(filename)] + filename.get_output_types()
+        for output_type in dict.fromkeys(output_types):
+            full_name = self.get_full_name(filename, output_type, level)
+            if os.path.exists(full_name):
+                return True, full_name
+        return False, self.get_full_name(filename, level=level)
 
     def __repr__(self) -> str:
         return self.tree_name
 
 
+SKELETON_STEPS = [Reader.DataStep.SKELETON_FILENAME, Reader.DataStep.SKELETON_NEW, Reader.DataStep.MORPHOLOGICAL_SKELETON,
+                  Reader.DataStep.TRIMMED_SKELETON]
+
+
+class _ModelUnpickler(pickle.Unpickler):
+    MODEL_PACKAGE = 'modules.common.src.model'
+
+    def find_class(self, module: str, name: str) -> Any:
+        if module == 'DAG':
+            module = f'{self.MODEL_PACKAGE}.DAG'
+        elif module == 'model' or module.startswith('model.'):
+            module = self.MODEL_PACKAGE + module[len('model'):]
+        return super().find_class(module, name)
+
+
+def write_atomically(full_name: str, write: Callable[[BinaryIO], None]) -> None:
+    temp_name = f'{full_name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_name, 'wb') as output:
+            write(output)
+        os.replace(temp_name, full_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
 def get_readers(dir_names: list[str], to_left: list = None, default_size: int = None, use_cache: bool = False,
-                force_override: bool = False) -> list[Reader]:
-    return [Reader(x, default_size=default_size, use_cache=use_cache, force_override=force_override) for x in dir_names
-            if (to_left is None or x in to_left)]
+                force_override: bool = False, array_output: OutputType = OutputType.ARRAY_OUTPUT,
+                dag_output: OutputType = OutputType.DAG_OUTPUT, sparse_skeletons: bool = False,
+                compact_dags: bool = False) -> list[Reader]:
+    return [Reader(x, default_size=default_size, use_cache=use_cache, force_override=force_override,
+                   array_output=array_output, dag_output=dag_output, sparse_skeletons=sparse_skeletons,
+                   compact_dags=compact_dags) for x in dir_names if (to_left is None or x in to_left)]
 
 
 def save_figure(plt: Any, type_name: str, tree_name: str) -> None:
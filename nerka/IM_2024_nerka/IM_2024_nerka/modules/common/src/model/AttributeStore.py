@@ -0,0 +1,247 @@
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator, Optional
+
+import numpy as np
+
+MISSING = object()
+
+
+class AttributeVersion:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def bump(self) -> None:
+        self.value += 1
+
+
+class ArrayColumn:
+
+    def __init__(self, values: np.ndarray, present: Optional[np.ndarray] = None, nulls: Optional[np.ndarray] = None,
+                 python: bool = False):
+        self.values = values
+        self.present = present
+        self.nulls = nulls
+        self.python = python
+
+    def has(self, index: int) -> bool:
+        return self.present is None or bool(self.present[index])
+
+    def get(self, index: int) -> Any:
+        if self.nulls is not None and self.nulls[index]:
+            return None
+        value = self.values[index]
+        return value.item() if self.python else value
+
+    def can_store(self, value: Any) -> bool:
+        if not np.isscalar(value):
+            return False
+        return np.result_type(self.values.dtype, np.asarray(value).dtype) == self.values.dtype
+
+    def set(self, index: int, value: Any) -> None:
+        self.values[index] = value
+        if self.nulls is not None:
+            self.nulls[index] = False
+        if self.present is not None:
+            self.present[index] = True
+
+    def copy(self) -> 'ArrayColumn':
+        return ArrayColumn(self.values.copy(), None if self.present is None else self.present.copy(),
+                           None if self.nulls is None else self.nulls.copy(), self.python)
+
+    def to_list(self) -> list:
+        values = self.values.tolist() if self.python else list(self.values)
+        if self.nulls is not None:
+            values = [None if is_null else x for x, is_null in zip(values, self.nulls.tolist())]
+        if self.present is not None:
+            values = [x if is_present else MISSING for x, is_present in zip(values, self.present.tolist())]
+        return values
+
+    @property
+    def nbytes(self) -> int:
+        return sum(x.nbytes for x in (self.values, self.present, self.nulls) if x is not None)
+
+
+class RaggedColumn:
+
+    def __init__(self, values: np.ndarray, offsets: np.ndarray, shapes: np.ndarray, kind: str = 'array',
+                 present: Optional[np.ndarray] = None, python: bool = False):
+        self.values = values
+        self.offsets = offsets
+        self.shapes = shapes
+        self.kind = kind
+        self.present = present
+        self.python = python
+        self.positions = None if present is None else np.cumsum(present) - 1
+
+    def has(self, index: int) -> bool:
+        return self.present is None or bool(self.present[index])
+
+    def get_block(self, index: int) -> np.ndarray:
+        position = index if self.positions is None else self.positions[index]
+        return self.values[self.offsets[position]:self.offsets[position + 1]].reshape(self.shapes[position])
+
+    def get(self, index: int) -> Any:
+        block = self.get_block(index)
+        if self.kind == 'array':
+            return block
+        if self.kind == 'tuple_list':
+            return list(map(tuple, block.tolist() if self.python else block))
+        values = block.tolist() if self.python else list(block)
+        return tuple(values) if self.kind == 'tuple' else values
+
+    def to_list(self) -> list:
+        length = len(self.offsets) - 1 if self.present is None else len(self.present)
+        return [self.get(i) if self.has(i) else MISSING for i in range(length)]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(x.nbytes for x in (self.values, self.offsets, self.shapes, self.present) if x is not None)
+
+
+class ReferenceColumn:
+
+    def __init__(self, indices: np.ndarray, resolve: Callable[[int], Any], present: Optional[np.ndarray] = None):
+        self.indices = indices
+        self.resolve = resolve
+        self.present = present
+
+    def has(self, index: int) -> bool:
+        return self.present is None or bool(self.present[index])
+
+    def get(self, index: int) -> Any:
+        target = self.indices[index]
+        return None if target < 0 else self.resolve(int(target))
+
+    def to_list(self) -> list:
+        return [self.get(i) if self.has(i) else MISSING for i in range(len(self.indices))]
+
+    @property
+    def nbytes(self) -> int:
+        return self.indices.nbytes + (0 if self.present is None else self.present.nbytes)
+
+
+class ObjectColumn:
+
+    def __init__(self, values: list):
+        self.values = values
+
+    def has(self, index: int) -> bool:
+        return self.values[index] is not MISSING
+
+    def get(self, index: int) -> Any:
+        return self.values[index]
+
+    def set(self, index: int, value: Any) -> None:
+        self.values[index] = value
+
+    def copy(self) -> 'ObjectColumn':
+        return ObjectColumn(list(self.values))
+
+    def to_list(self) -> list:
+        return self.values
+
+    @property
+    def nbytes(self) -> int:
+        return 8 * len(self.values)
+
+
+class AttributeStore:
+
+    def __init__(self, length: int, columns: dict[str, Any] = None, shared: set[str] = None):
+        self.length = length
+        self.columns = {} if columns is None else columns
+        self.shared = set() if shared is None else shared
+        self.attribute_version: Optional[AttributeVersion] = None
+
+    def has(self, index: int, key: str) -> bool:
+        column = self.columns.get(key, None)
+        return column is not None and column.has(index)
+
+    def get(self, index: int, key: str) -> Any:
+        if not self.has(index, key):
+            raise KeyError(key)
+        return self.columns[key].get(index)
+
+    def set(self, index: int, key: str, value: Any) -> None:
+        column = self.columns.get(key, None)
+        if isinstance(column, ArrayColumn) and column.can_store(value):
+            self.__get_own_column(key).set(index, value)
+        else:
+            self.__get_object_column(key).set(index, value)
+        self.__bump()
+
+    def delete(self, index: int, key: str) -> None:
+        if not self.has(index, key):
+            raise KeyError(key)
+        self.__get_object_column(key).set(index, MISSING)
+        self.__bump()
+
+    def keys(self, index: int) -> list[str]:
+        return [key for key, column in self.columns.items() if column.has(index)]
+
+    def get_column(self, key: str) -> Any:
+        return self.columns[key]
+
+    def copy(self) -> 'AttributeStore':
+        self.shared.update(self.columns.keys())
+        return AttributeStore(self.length, dict(self.columns), set(self.columns.keys()))
+
+    def view(self, index: int) -> 'AttributeView':
+        return AttributeView(self, index)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(x.nbytes for x in self.columns.values())
+
+    def __bump(self) -> None:
+        if self.attribute_version is not None:
+            self.attribute_version.bump()
+
+    def __get_own_column(self, key: str) -> Any:
+        if key in self.shared:
+            self.columns[key] = self.columns[key].copy()
+            self.shared.discard(key)
+        return self.columns[key]
+
+    def __get_object_column(self, key: str) -> ObjectColumn:
+        column = self.columns.get(key, None)
+        if column is None:
+            column = ObjectColumn([MISSING] * self.length)
+        elif isinstance(column, ObjectColumn):
+            column = self.__get_own_column(key)
+        else:
+            column = ObjectColumn(column.to_list())
+        self.columns[key] = column
+        self.shared.discard(key)
+        return column
+
+
+class AttributeView(MutableMapping):
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: AttributeStore, index: int):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key: str) -> Any:
+        return self.store.get(self.index, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.store.set(self.index, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        self.store.delete(self.index, key)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.store.has(self.index, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.store.keys(self.index))
+
+    def __len__(self) -> int:
+        return len(self.store.keys(self.index))
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
@@ -1,33 +1,78 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Iterator
+
 from modules.common.src.app_utils.Reader import Reader
 from modules.common.src.model.DAG import DAG
 from modules.common.src.model.VolumeData import VolumeData
 
 
 class CaseData:
+    PREFETCH_WORKERS = 4
+    executor = None
+    executor_lock = threading.Lock()
 
-    def __init__(self, reader: Reader, volume=None):
-        self.__volume = volume
-        self.__skeleton = None
-        self.__thickness = None
-        self.__dag = None
+    def __init__(self, reader: Reader, volume=None, prefetch: list[Reader.DataStep] = None):
         self.__reader = reader
+        self.__prefetch = [] if prefetch is None else list(prefetch)
+        self.__futures: dict[Reader.DataStep, Future] = {}
+        self.__lock = threading.Lock()
+        if volume is not None:
+            self.__set_result(Reader.DataStep.RECONSTRUCTION_FILENAME, volume)
+        self.prefetch(self.__prefetch)
+
+    @staticmethod
+    def get_executor() -> ThreadPoolExecutor:
+        with CaseData.executor_lock:
+            if CaseData.executor is None:
+                CaseData.executor = ThreadPoolExecutor(max_workers=CaseData.PREFETCH_WORKERS,
+                                                       thread_name_prefix='CaseDataPrefetch')
+        return CaseData.executor
+
+    def get_reader(self) -> Reader:
+        return self.__reader
+
+    def prefetch(self, steps: list[Reader.DataStep]) -> None:
+        with self.__lock:
+            for step in steps:
+                if step not in self.__futures:
+                    self.__futures[step] = CaseData.get_executor().submit(self.__reader.load_data, step)
+
+    def prefetch_next(self, reader: Reader, prefetch: list[Reader.DataStep] = None) -> 'CaseData':
+        return CaseData(reader, prefetch=self.__prefetch if prefetch is None else prefetch)
 
     def get_dag(self) -> DAG:
-        if self.__dag is None:
-            self.__dag = self.__reader.load_data(Reader.DataStep.DAG_WITH_STATS_FILENAME)
-        return self.__dag
+        return self.__get(Reader.DataStep.DAG_WITH_STATS_FILENAME)
 
     def get_volume(self) -> VolumeData:
-        if self.__volume is None:
-            self.__volume = self.__reader.load_data(Reader.DataStep.RECONSTRUCTION_FILENAME)
-        return self.__volume
+        return self.__get(Reader.DataStep.RECONSTRUCTION_FILENAME)
 
     def get_skeleton(self) -> VolumeData:
-        if self.__skeleton is None:
-            self.__skeleton = self.__reader.load_data(Reader.DataStep.SKELETON_FILENAME)
-        return self.__skeleton
+        return self.__get(Reader.DataStep.SKELETON_FILENAME)
 
     def get_thickness(self) -> VolumeData:
-        if self.__thickness is None:
-            self.__thickness = self.__reader.load_data(Reader.DataStep.SKELETON_THICKNESS_FILENAME)
-        return self.__thickness
+        return self.__get(Reader.DataStep.SKELETON_THICKNESS_FILENAME)
+
+    def __get(self, step: Reader.DataStep) -> Any:
+        with self.__lock:
+            future = self.__futures.get(step, None)
+        if future is None:
+            return self.__set_result(step, self.__reader.load_data(step))
+        return future.result()
+
+    def __set_result(self, step: Reader.DataStep, data: Any) -> Any:
+        future = Future()
+        future.set_result(data)
+        with self.__lock:
+            self.__futures[step] = future
+        return data
+
+
+def iterate_cases(readers: list[Reader], prefetch: list[Reader.DataStep]) -> Iterator[CaseData]:
+    case = CaseData(readers[0], prefetch=prefetch) if len(readers) > 0 else None
+    for reader in readers[1:]:
+        next_case = case.prefetch_next(reader)
+        yield case
+        case = next_case
+    if case is not None:
+        yield case
@@ -0,0 +1,209 @@
+from collections.abc import Sequence
+from dataclasses import fields
+from typing import Any, Union
+
+import numpy as np
+from typing_extensions import Self
+
+from modules.common.src.model.AttributeStore import ArrayColumn, AttributeStore, AttributeView
+from modules.common.src.model.DAG import DAG, Adjacency, ImmutableDAGError, attribute_cache, versioned_cache
+from modules.common.src.model.Edge import Edge
+from modules.common.src.model.EdgeData import EdgeData
+from modules.common.src.model.Node import Node
+
+EDGE_DATA_FIELDS = [x.name for x in fields(EdgeData)]
+
+
+class NodeView:
+    __slots__ = ('dag', 'index')
+
+    def __init__(self, dag: 'CompactDAG', index: int):
+        self.dag = dag
+        self.index = index
+
+    @property
+    def coords(self) -> tuple:
+        coords = self.dag.node_coords[self.index]
+        return tuple(coords.tolist()) if self.dag.python_coords else tuple(coords)
+
+    @property
+    def edges(self) -> list['EdgeView']:
+        return [EdgeView(self.dag, x) for x in self.dag.get_edge_indices(self.index).tolist()]
+
+    @property
+    def data(self) -> AttributeView:
+        return self.dag.node_attributes.view(self.index)
+
+    def add_edge(self, edge):
+        raise ImmutableDAGError('Topology of a CompactDAG cannot be changed')
+
+    def copy_without_edges(self) -> Node:
+        copied_node = Node(self.coords)
+        copied_node.data = dict(self.data)
+        return copied_node
+
+    get_neighbours = Node.get_neighbours
+    __setitem__ = Node.__setitem__
+    __getitem__ = Node.__getitem__
+
+    def __eq__(self, other) -> bool:
+        return hasattr(other, 'coords') and self.coords == other.coords
+
+    def __hash__(self) -> int:
+        return hash((self.coords,))
+
+    def __repr__(self) -> str:
+        return f'NodeView(coords={self.coords})'
+
+
+class EdgeDataView:
+    __slots__ = ('dag', 'index')
+
+    def __init__(self, dag: 'CompactDAG', index: int):
+        self.dag = dag
+        self.index = index
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in EDGE_DATA_FIELDS:
+            raise AttributeError(name)
+        return self.dag.edge_fields.get(self.index, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in EdgeDataView.__slots__:
+            object.__setattr__(self, name, value)
+        elif name in EDGE_DATA_FIELDS:
+            self.dag.edge_fields.set(self.index, name, value)
+        else:
+            raise AttributeError(name)
+
+    def __eq__(self, other) -> bool:
+        return all(getattr(self, x) == getattr(other, x) for x in EDGE_DATA_FIELDS)
+
+    def __repr__(self) -> str:
+        return f'EdgeData({", ".join(f"{x}={getattr(self, x)}" for x in EDGE_DATA_FIELDS)})'
+
+
+class EdgeView:
+    __slots__ = ('dag', 'index')
+
+    def __init__(self, dag: 'CompactDAG', index: int):
+        self.dag = dag
+        self.index = index
+
+    @property
+    def node_a(self) -> NodeView:
+        return NodeView(self.dag, int(self.dag.edge_nodes[self.index, 0]))
+
+    @property
+    def node_b(self) -> NodeView:
+        return NodeView(self.dag, int(self.dag.edge_nodes[self.index, 1]))
+
+    @property
+    def data(self) -> AttributeView:
+        return self.dag.edge_attributes.view(self.index)
+
+    @property
+    def edge_data(self) -> EdgeDataView:
+        return EdgeDataView(self.dag, self.index)
+
+    is_same_generation = Edge.is_same_generation
+    get_generation = Edge.get_generation
+    __setitem__ = Edge.__setitem__
+    __getitem__ = Edge.__getitem__
+    __eq__ = Edge.__eq__
+    __hash__ = Edge.__hash__
+
+    def __repr__(self) -> str:
+        return f'EdgeView(node_a={self.node_a}, node_b={self.node_b})'
+
+
+class _ViewList(Sequence):
+
+    def __init__(self, dag: 'CompactDAG', view_type: type, length: int):
+        self.dag = dag
+        self.view_type = view_type
+        self.length = length
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self.view_type(self.dag, x) for x in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(index)
+        return self.view_type(self.dag, index)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        return (self.view_type(self.dag, x) for x in range(self.length))
+
+
+class CompactDAG(DAG):
+    mutable = False
+
+    def __init__(self, root_index: int, volume_shape: Any, node_coords: np.ndarray, edge_nodes: np.ndarray,
+                 node_edge_offsets: np.ndarray, node_edge_ids: np.ndarray, edge_fields: AttributeStore,
+                 node_attributes: AttributeStore = None, edge_attributes: AttributeStore = None,
+                 python_coords: bool = True):
+        self.node_coords = node_coords
+        self.edge_nodes = edge_nodes
+        self.node_edge_offsets = node_edge_offsets
+        self.node_edge_ids = node_edge_ids
+        self.edge_fields = edge_fields
+        self.node_attributes = AttributeStore(len(node_coords)) if node_attributes is None else node_attributes
+        self.edge_attributes = AttributeStore(len(edge_nodes)) if edge_attributes is None else edge_attributes
+        self.python_coords = python_coords
+        self.root_index = root_index
+        root = NodeView(self, root_index) if root_index >= 0 else None
+        super().__init__(root, volume_shape, _ViewList(self, NodeView, len(node_coords)),
+                         _ViewList(self, EdgeView, len(edge_nodes)))
+
+    def attach(self, edges: Any) -> None:
+        for store in (self.edge_fields, self.node_attributes, self.edge_attributes):
+            store.attribute_version = self.attribute_version
+
+    def get_node_view(self, index: int) -> NodeView:
+        return NodeView(self, index)
+
+    def get_edge_view(self, index: int) -> EdgeView:
+        return EdgeView(self, index)
+
+    def get_edge_indices(self, node_index: int) -> np.ndarray:
+        return self.node_edge_ids[self.node_edge_offsets[node_index]:self.node_edge_offsets[node_index + 1]]
+
+    def get_edge_field(self, name: str) -> np.ndarray:
+        column = self.edge_fields.get_column(name)
+        if not isinstance(column, ArrayColumn):
+            return np.array([np.nan if x is None else x for x in column.to_list()])
+        if column.nulls is None:
+            return column.values
+        return np.where(column.nulls, np.nan, column.values)
+
+    @versioned_cache
+    def get_nodes_by_level(self, level: int) -> list[NodeView]:
+        return [NodeView(self, x) for x in np.flatnonzero(np.diff(self.node_edge_offsets) == level).tolist()]
+
+    @attribute_cache
+    def get_adjacency(self) -> Adjacency:
+        return Adjacency(self.edge_nodes, self.node_edge_offsets, self.node_edge_ids,
+                         self.get_edge_field('generation'), self.root_index)
+
+    def get_shape(self) -> tuple:
+        if len(self.node_coords) == 0:
+            return 1, 1, 1
+        return tuple(int(x) + 1 for x in np.maximum(self.node_coords.max(axis=0), 0))
+
+    def get_structure_copy(self) -> Self:
+        dag = CompactDAG(self.root_index, self.volume_shape, self.node_coords, self.edge_nodes, self.node_edge_offsets,
+                         self.node_edge_ids, self.edge_fields.copy(), python_coords=self.python_coords)
+        dag.id = self.id
+        return dag
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [self.node_coords, self.edge_nodes, self.node_edge_offsets, self.node_edge_ids]
+        return (sum(x.nbytes for x in arrays) + self.edge_fields.nbytes + self.node_attributes.nbytes
+                + self.edge_attributes.nbytes)
+
@@ -1,13 +1,16 @@
 import pickle
-import queue
-from copy import deepcopy
-from functools import cache
-from typing import Any
+from copy import copy
+from functools import wraps
+from typing import Any, Callable, Iterable, NamedTuple, Optional, Union
 
 import numpy as np
 from typing_extensions import Self
 
 from modules.common.src.app_utils.Logger import get_logger
+from modules.common.src.model.AttributeStore import AttributeVersion
+from modules.common.src.model.EdgeTable import EdgeTable
+from modules.common.src.model.SpatialIndex import SpatialIndex
+from modules.common.src.model.TreeMetrics import TreeMetrics, compute_tree_metrics
 from modules.common.src.model.VolumeData import VolumeData
 from modules.common.src.model import Node, Edge
 
@@ -23,7 +26,54 @@ class AbstractTraverseListener:
         pass
 
 
+class ImmutableDAGError(TypeError):
+    pass
+
+
+class Adjacency(NamedTuple):
+    edge_nodes: np.ndarray
+    node_edge_offsets: np.ndarray
+    node_edge_ids: np.ndarray
+    generations: np.ndarray
+    root: int
+
+
+class Traversal(NamedTuple):
+    parent_edges: np.ndarray
+    edges: np.ndarray
+    depths: np.ndarray
+    edge_generations: np.ndarray
+
+    @property
+    def generations(self) -> np.ndarray:
+        return self.edge_generations[self.edges]
+
+
+def versioned_cache(function: Callable) -> Callable:
+    return _versioned_cache(function, False)
+
+
+def attribute_cache(function: Callable) -> Callable:
+    return _versioned_cache(function, True)
+
+
+def _versioned_cache(function: Callable, attributes: bool) -> Callable:
+    @wraps(function)
+    def wrapper(self, *args, **kwargs):
+        key = (function.__name__,) + args + tuple(sorted(kwargs.items()))
+        stamp = self.version, self.attribute_version.value if attributes else 0, len(self.nodes), len(self.edges)
+        entry = self.derived_cache.get(key, None)
+        if entry is None or entry[0] != stamp:
+            entry = stamp, function(self, *args, **kwargs)
+            self.derived_cache[key] = entry
+        return entry[1]
+
+    return wrapper
+
+
 class DAG:
+    mutable = True
+
     def __init__(self, root: Node, volume_shape: VolumeData, nodes: list[Node], edges: list[Edge]):
         self.id = ''
         self.root = root
@@ -31,25 +81,186 @@ class DAG:
         self.edges = edges
         self.volume_shape = volume_shape
         self.data = {}
+        self.version = 0
+        self.derived_cache = {}
+        self.attribute_version = AttributeVersion()
+        self.attach(edges)
 
     def get_coords_node_dict(self) -> dict[tuple, Node]:
-        return {xyz.coords: xyz for xyz in self.nodes}
+        return self.__get_indexes()[1]
+
+    def get_node(self, coords: tuple) -> Optional[Node]:
+        return self.__get_indexes()[1].get(coords, None)
+
+    def attach(self, edges: Iterable[Edge]) -> None:
+        for edge in edges:
+            edge.attach(self.attribute_version)
+
+    def invalidate(self) -> None:
+        self.version += 1
+        self.__dict__.pop('_DAG__indexes', None)
+
+    def add_node(self, node: Union[Node, tuple]) -> Node:
+        self.__check_mutable()
+        node = node if isinstance(node, Node) else Node(tuple(node))
+        if self.get_node(node.coords) is not None:
+            raise ValueError(f'Node with coords {node.coords} is already part of DAG')
+        self.nodes.append(node)
+        self.__update_indexes(added_nodes=[node])
+        return node
+
+    def add_edge(self, node_a: Node, node_b: Node) -> Edge:
+        self.__check_mutable()
+        node_a, node_b = self.get_node(node_a.coords), self.get_node(node_b.coords)
+        if node_a is None or node_b is None:
+            raise ValueError('Both nodes have to be part of DAG before they can be connected')
+        edge = Edge(node_a, node_b)
+        node_a.add_edge(edge)
+        if 'parent' in node_b.data:
+            node_b['parent'] = node_a
+        self.edges.append(edge)
+        self.__update_indexes(added_edges=[edge])
+        return edge
 
     def remove_node(self, node: Node) -> None:
-        if node not in self.nodes:
-            get_logger().warning(f'Node {node} is not part of DAG, hence cannot be removed')
+        self.remove_nodes([node])
+
+    def remove_nodes(self, nodes: Iterable[Node]) -> None:
+        self.__check_mutable()
+        coords_node_dict = self.get_coords_node_dict()
+        removed = {}
+        for node in nodes:
+            if coords_node_dict.get(node.coords, None) is None:
+                get_logger().warning(f'Node {node} is not part of DAG, hence cannot be removed')
+                continue
+            removed[id(coords_node_dict[node.coords])] = coords_node_dict[node.coords]
+        if len(removed) == 0:
             return
-        if len(node.edges) > 2:
-            get_logger().warning(f'Node {node} has {len(node.edges)} edges hence cannot be removed')
-            raise NotImplementedError('Not yet implemented')
-        # TODO: removing node
+        self.remove_edges([x for x in self.edges if id(x.node_a) in removed or id(x.node_b) in removed])
+        self.nodes[:] = [x for x in self.nodes if id(x) not in removed]
+        if self.root is not None and id(self.root) in removed:
+            self.root = None
+        self.__update_indexes(removed_nodes=list(removed.values()))
 
-    def get_edge(self, param_edge: Edge) -> Edge:
-        for edge in self.edges:
-            if edge == param_edge:
-                return edge
+    def remove_edge(self, edge: Edge) -> None:
+        self.remove_edges([edge])
+
+    def remove_edges(self, edges: Iterable[Edge]) -> None:
+        self.__check_mutable()
+        removed = {id(x): x for x in (self.get_edge(edge) for edge in edges) if x is not None}
+        if len(removed) == 0:
+            return
+        for edge in removed.values():
+            for node in (edge.node_a, edge.node_b):
+                if any(id(x) in removed for x in node.edges):
+                    node.edges[:] = [x for x in node.edges if id(x) not in removed]
+            if edge.node_b.data.get('parent', None) is edge.node_a:
+                edge.node_b['parent'] = None
+        self.edges[:] = [x for x in self.edges if id(x) not in removed]
+        self.__update_indexes(removed_edges=list(removed.values()))
+
+    def contract_degree_2_nodes(self) -> int:
+        self.__check_mutable()
+        parent_edges = {id(edge.node_b): edge for edge in self.edges}
+        removed_nodes, removed_edges, added_edges = {}, {}, []
+        for node in self.nodes:
+            parent_edge = parent_edges.get(id(node), None)
+            if node is self.root or parent_edge is None or len(node.edges) != 1:
+                continue
+            child_edge = node.edges[0]
+            edge = _merge_edges(parent_edge, child_edge)
+            parent_edge.node_a.edges[parent_edge.node_a.edges.index(parent_edge)] = edge
+            if 'parent' in child_edge.node_b.data:
+                child_edge.node_b['parent'] = edge.node_a
+            parent_edges[id(child_edge.node_b)] = edge
+            removed_nodes[id(node)] = node
+            removed_edges[id(parent_edge)] = parent_edge
+            removed_edges[id(child_edge)] = child_edge
+            added_edges.append(edge)
+        if len(removed_nodes) == 0:
+            return 0
+        added_edges = [x for x in added_edges if id(x) not in removed_edges]
+        self.edges[:] = [x for x in self.edges if id(x) not in removed_edges] + added_edges
+        self.nodes[:] = [x for x in self.nodes if id(x) not in removed_nodes]
+        self.__update_indexes(added_edges=added_edges, removed_nodes=list(removed_nodes.values()),
+                              removed_edges=list(removed_edges.values()))
+        return len(removed_nodes)
+
+    def prune_spurs(self, min_length: float, repeat: bool = False) -> int:
+        self.__check_mutable()
+        pruned = 0
+        while True:
+            spurs = [x for x in self.edges if len(x.node_b.edges) == 0 and _get_edge_length(x) < min_length]
+            if len(spurs) == 0:
+                return pruned
+            self.remove_nodes([x.node_b for x in spurs])
+            pruned += len(spurs)
+            if not repeat:
+                return pruned
+
+    def __check_mutable(self) -> None:
+        if not self.mutable:
+            raise ImmutableDAGError(f'Topology of a {type(self).__name__} cannot be changed')
 
-    @cache
+    def __update_indexes(self, added_nodes: list[Node] = (), added_edges: list[Edge] = (),
+                         removed_nodes: list[Node] = (), removed_edges: list[Edge] = ()) -> None:
+        self.version += 1
+        self.attach(added_edges)
+        indexes = self.__dict__.get('_DAG__indexes', None)
+        if indexes is None:
+            return
+        _, coords_node_dict, edge_index = indexes
+        for node in removed_nodes:
+            if coords_node_dict.get(node.coords, None) is node:
+                del coords_node_dict[node.coords]
+        for edge in removed_edges:
+            key = get_edge_key(edge.node_a.coords, edge.node_b.coords)
+            if edge_index.get(key, None) is edge:
+                del edge_index[key]
+        for node in added_nodes:
+            coords_node_dict[node.coords] = node
+        for edge in added_edges:
+            edge_index.setdefault(get_edge_key(edge.node_a.coords, edge.node_b.coords), edge)
+        self.__indexes = (len(self.nodes), len(self.edges)), coords_node_dict, edge_index
+
+    def get_edge(self, param_edge: Edge) -> Optional[Edge]:
+        return self.get_edge_between(param_edge.node_a.coords, param_edge.node_b.coords)
+
+    def get_edge_between(self, coords_a: tuple, coords_b: tuple) -> Optional[Edge]:
+        return self.__get_indexes()[2].get(get_edge_key(coords_a, coords_b), None)
+
+    def get_edges(self, pairs: Iterable[Union[Edge, tuple[tuple, tuple]]]) -> list[Optional[Edge]]:
+        edge_index = self.__get_indexes()[2]
+        keys = [get_edge_key(x.node_a.coords, x.node_b.coords) if hasattr(x, 'node_a') else get_edge_key(*x)
+                for x in pairs]
+        return [edge_index.get(key, None) for key in keys]
+
+    def __get_indexes(self) -> tuple[tuple[int, int], dict[tuple, Node], dict[tuple, Edge]]:
+        sizes = (len(self.nodes), len(self.edges))
+        indexes = self.__dict__.get('_DAG__indexes', None)
+        if indexes is None or indexes[0] != sizes:
+            edge_index = {}
+            for edge in self.edges:
+                edge_index.setdefault(get_edge_key(edge.node_a.coords, edge.node_b.coords), edge)
+            indexes = sizes, {node.coords: node for node in self.nodes}, edge_index
+            self.__indexes = indexes
+        return indexes
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state.pop('_DAG__indexes', None)
+        state['derived_cache'] = {}
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.__dict__.setdefault('version', 0)
+        self.__dict__.setdefault('derived_cache', {})
+        if 'attribute_version' not in self.__dict__:
+            self.attribute_version = AttributeVersion()
+            self.attach(self.edges)
+
+    @versioned_cache
     def get_nodes_by_level(self, level: int) -> list[Node]:
         node_list: list[Node] = []
         for node in self.nodes:
@@ -57,24 +268,24 @@ class DAG:
                 node_list.append(node)
         return node_list
 
-    @cache
+    @attribute_cache
     def get_generation_node_dict(self) -> dict[int, list[Node]]:
         generation_to_node_dict: dict[int, list[Node]] = {}
-
-        class Listener(AbstractTraverseListener):
-            def on_edge_traversed(self, parent_edge: Edge, edge: Edge):
-                if parent_edge is None:
-                    generation_to_node_dict[0] = [edge.node_a]
-                else:
-                    generation = parent_edge.get_generation()
-                    if generation not in generation_to_node_dict.keys():
-                        generation_to_node_dict[generation] = []
-                    generation_to_node_dict[generation].append(edge.node_a)
-
-        self.traverse_from_root(Listener())
+        traversal = self.get_traversal()
+        if len(traversal.edges) == 0:
+            return generation_to_node_dict
+        adjacency = self.get_adjacency()
+        generation_to_node_dict[0] = [self.nodes[adjacency.root]]
+        with_parent = traversal.parent_edges >= 0
+        parent_generations = adjacency.generations[traversal.parent_edges[with_parent]]
+        parent_nodes = adjacency.edge_nodes[traversal.edges[with_parent], 0]
+        generations, first_indices = np.unique(parent_generations, return_index=True)
+        for generation in generations[np.argsort(first_indices)].tolist():
+            node_indices = parent_nodes[parent_generations == generation].tolist()
+            generation_to_node_dict.setdefault(generation, []).extend(self.nodes[x] for x in node_indices)
         return generation_to_node_dict
 
-    @cache
+    @attribute_cache
     def get_number_of_full_levels(self) -> int:
         full: int = 0
         all_full: bool = True
@@ -93,21 +304,83 @@ class DAG:
             node_list += generation_node_dict[generation]
         return node_list
 
+    @attribute_cache
+    def get_adjacency(self) -> Adjacency:
+        node_index = {id(node): i for i, node in enumerate(self.nodes)}
+        edge_index = {id(edge): i for i, edge in enumerate(self.edges)}
+        return Adjacency(
+            np.array([(node_index[id(x.node_a)], node_index[id(x.node_b)]) for x in self.edges],
+                     dtype=np.int64).reshape(-1, 2),
+            np.cumsum([0] + [len(node.edges) for node in self.nodes], dtype=np.int64),
+            np.array([edge_index[id(edge)] for node in self.nodes for edge in node.edges], dtype=np.int64),
+            np.array([x.edge_data.generation for x in self.edges]),
+            node_index.get(id(self.root), -1))
+
+    @attribute_cache
+    def get_traversal(self, max_generation=np.inf) -> Traversal:
+        adjacency = self.get_adjacency()
+        parent_edges, edges, depths = [], [], []
+        if adjacency.root >= 0:
+            frontier_nodes = np.array([adjacency.root], dtype=np.int64)
+            frontier_edges = np.array([-1], dtype=np.int64)
+            depth = 1
+            while len(frontier_nodes) > 0 and depth <= len(self.edges):
+                starts = adjacency.node_edge_offsets[frontier_nodes]
+                counts = adjacency.node_edge_offsets[frontier_nodes + 1] - starts
+                level_offsets = np.cumsum(counts) - counts
+                positions = np.repeat(starts - level_offsets, counts) + np.arange(counts.sum())
+                level_edges = adjacency.node_edge_ids[positions]
+                parent_edges.append(np.repeat(frontier_edges, counts))
+                edges.append(level_edges)
+                depths.append(np.full(len(level_edges), depth, dtype=np.int64))
+                frontier_edges = level_edges[adjacency.generations[level_edges] < max_generation]
+                frontier_nodes = adjacency.edge_nodes[frontier_edges, 1]
+                depth += 1
+        return Traversal(*[np.concatenate(x) if len(x) > 0 else np.zeros(0, dtype=np.int64)
+                           for x in (parent_edges, edges, depths)], adjacency.generations)
+
     def traverse_from_root(self, traverse_listener: AbstractTraverseListener, max_generation=np.inf):
-        q = queue.Queue()
-        q.put((None, self.root))
-        while not q.empty():
-            parent_edge, node = q.get()
-            for edge in node.edges:
-                traverse_listener.on_edge_traversed(parent_edge, edge)
-                if edge.edge_data.generation < max_generation:
-                    q.put((edge, edge.node_b))
+        traversal = self.get_traversal(max_generation)
+        for parent_edge, edge in zip(traversal.parent_edges.tolist(), traversal.edges.tolist()):
+            traverse_listener.on_edge_traversed(None if parent_edge < 0 else self.edges[parent_edge], self.edges[edge])
 
     def get_edges_by_parameter(self, parameter_name: str, parameter_value: Any) -> list:
-        ret = [x for x in self.edges if x[parameter_name] == parameter_value]
+        ret = self.query_edges(**{parameter_name: parameter_value})
         get_logger().debug(f'Numer of filtered edges {len(ret)}')
         return ret
 
+    @attribute_cache
+    def get_edge_table(self) -> EdgeTable:
+        return EdgeTable(self)
+
+    @attribute_cache
+    def get_tree_metrics(self) -> TreeMetrics:
+        return compute_tree_metrics(self)
+
+    def get_node_metrics(self, node: Node) -> dict[str, Any]:
+        node_index = self.get_node_indices()[node.coords]
+        return {name: values[node_index] for name, values in self.get_tree_metrics().node.items()}
+
+    @versioned_cache
+    def get_node_indices(self) -> dict[tuple, int]:
+        return {node.coords: i for i, node in enumerate(self.nodes)}
+
+    def query_edges(self, **predicates) -> list[Edge]:
+        table = self.get_edge_table()
+        return table.get_edges(table.select(**predicates))
+
+    @attribute_cache
+    def get_spatial_index(self) -> SpatialIndex:
+        return SpatialIndex(self)
+
+    def get_nearest_nodes(self, points: Any, max_distance: float = np.inf) -> list[Optional[Node]]:
+        index = self.get_spatial_index()
+        return index.get_nodes(index.nearest_nodes(points, max_distance)[1])
+
+    def get_nearest_edges(self, points: Any, max_distance: float = np.inf) -> list[Optional[Edge]]:
+        index = self.get_spatial_index()
+        return index.get_edges(index.nearest_edges(points, max_distance)[1])
+
     def __setitem__(self, key, value):
         self.data[key] = value
 
@@ -121,6 +394,7 @@ class DAG:
         with open(filename, 'wb') as output:
             pickle.dump(self, output)
 
+    @versioned_cache
     def get_shape(self) -> tuple:
         shape = (0, 0, 0)
         for node in self.nodes:
@@ -129,15 +403,50 @@ class DAG:
         return shape
 
     def get_structure_copy(self) -> Self:
-        dag = deepcopy(self)
-        dag.data = {}
-        for edge in dag.edges:
-            edge.data = {}
-        for node in dag.nodes:
-            node.data = {}
+        # Object nodes own their edge lists and edges own their attributes, so only CompactDAG copies share topology
+        nodes = {id(x): Node(x.coords) for x in self.nodes}
+        edges = {}
+        for edge in self.edges:
+            edges[id(edge)] = Edge(nodes[id(edge.node_a)], nodes[id(edge.node_b)])
+            edges[id(edge)].edge_data = copy(edge.edge_data)
+        for node in self.nodes:
+            nodes[id(node)].edges = [edges[id(x)] for x in node.edges]
+        root = None if self.root is None else nodes[id(self.root)]
+        dag = DAG(root, self.volume_shape, list(nodes.values()), list(edges.values()))
+        dag.id = self.id
         return dag
 
 
+def _get_edge_length(edge: Edge) -> float:
+    if edge.edge_data.length:
+        return edge.edge_data.length
+    return float(np.linalg.norm(np.subtract(edge.node_b.coords, edge.node_a.coords)))
+
+
+def _merge_edges(parent_edge: Edge, child_edge: Edge) -> Edge:
+    edge = Edge(parent_edge.node_a, child_edge.node_b)
+    lengths = [_get_edge_length(parent_edge), _get_edge_length(child_edge)]
+    edge.edge_data.relative_angle = parent_edge.edge_data.relative_angle
+    edge.edge_data.generation = parent_edge.edge_data.generation
+    edge.edge_data.length = sum(lengths)
+    edge.edge_data.thickness = (np.average([parent_edge.edge_data.thickness, child_edge.edge_data.thickness],
+                                           weights=lengths) if sum(lengths) > 0 else parent_edge.edge_data.thickness)
+    edge.edge_data.end_to_end_length = float(np.linalg.norm(np.subtract(edge.node_b.coords, edge.node_a.coords)))
+    if 'voxels' in parent_edge.data and 'voxels' in child_edge.data:
+        parent_voxels, child_voxels = parent_edge['voxels'], child_edge['voxels']
+        node_coords = parent_edge.node_b.coords
+        if isinstance(parent_voxels, np.ndarray) or isinstance(child_voxels, np.ndarray):
+            edge.data['voxels'] = np.concatenate([np.asarray(parent_voxels).reshape(-1, 3), [node_coords],
+                                                  np.asarray(child_voxels).reshape(-1, 3)]).astype(np.int64)
+        else:
+            edge.data['voxels'] = list(parent_voxels) + [node_coords] + list(child_voxels)
+    return edge
+
+
+def get_edge_key(coords_a: tuple, coords_b: tuple) -> tuple[tuple, tuple]:
+    return (coords_a, coords_b) if coords_a <= coords_b else (coords_b, coords_a)
+
+
 def get_max_coords(max_coords: tuple, new_coords: tuple) -> tuple:
     coord_list = []
     for new_coord, max_coord in zip(max_coords, new_coords):
@@ -1,17 +1,65 @@
 from dataclasses import dataclass, field
-from typing import Any
+from typing import Any, Optional
 
 from modules.common.src.model import Node
+from modules.common.src.model.AttributeStore import AttributeVersion
 from modules.common.src.model.EdgeData import EdgeData
 
 
+class EdgeAttributes(dict):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.attribute_version: Optional[AttributeVersion] = None
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.__bump()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.__bump()
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.__bump()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self.__bump()
+        return super().setdefault(key, default)
+
+    def pop(self, key, *args):
+        self.__bump()
+        return super().pop(key, *args)
+
+    def popitem(self):
+        self.__bump()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        self.__bump()
+
+    def __bump(self) -> None:
+        attribute_version = self.__dict__.get('attribute_version', None)
+        if attribute_version is not None:
+            attribute_version.bump()
+
+
 @dataclass
 class Edge:
     node_a: Node
     node_b: Node
-    data: dict[str, Any] = field(init=False, default_factory=lambda: {}, repr=False)
+    data: dict[str, Any] = field(init=False, default_factory=lambda: EdgeAttributes(), repr=False)
     edge_data: EdgeData = field(init=False, default_factory=lambda: EdgeData(), repr=False)
 
+    def attach(self, attribute_version: AttributeVersion) -> None:
+        if not isinstance(self.data, EdgeAttributes):
+            self.data = EdgeAttributes(self.data)
+        self.data.attribute_version = attribute_version
+        self.edge_data.attribute_version = attribute_version
+
     def is_same_generation(self, other) -> bool:
         return self.edge_data.generation == other.edge_data.generation
 
@@ -41,4 +89,4 @@ class Edge:
                 self.node_a == other.node_b and self.node_b == other.node_a)  # Because graph is not directed order of nodes in edge is unimportant
 
     def __hash__(self) -> int:
-        return hash(self.node_a.__hash__() + self.node_b.__hash__())
+        return hash(frozenset((self.node_a.coords, self.node_b.coords)))
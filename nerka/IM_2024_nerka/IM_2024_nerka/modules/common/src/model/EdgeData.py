@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+from typing import Any
 
 
 @dataclass
@@ -8,3 +9,9 @@ class EdgeData:
     thickness: float = field(init=False, default=0, repr=True, compare=True, hash=True)
     generation: int = field(init=False, default=0, repr=True, compare=True, hash=True)
     end_to_end_length: float = field(init=False, default=0, repr=True, compare=True, hash=True)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        attribute_version = self.__dict__.get('attribute_version', None)
+        if attribute_version is not None and name != 'attribute_version':
+            attribute_version.bump()
@@ -0,0 +1,130 @@
+from typing import Any, Callable, Union
+
+import numpy as np
+
+from modules.common.src.model.AttributeStore import ArrayColumn
+from modules.common.src.model.TreeMetrics import EDGE_METRICS
+
+EDGE_DATA_COLUMNS = {'relative_angle': 'relative_angle', 'length': 'length', 'mean_thickness': 'thickness',
+                     'thickness': 'thickness', 'generation': 'generation', 'end_to_end_length': 'end_to_end_length'}
+DEFAULT_STATISTICS = ('count', 'mean', 'std', 'min', 'max')
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75)
+
+Predicate = Union[Any, tuple[Any, Any], Callable[[np.ndarray], np.ndarray]]
+
+
+class EdgeTable:
+
+    def __init__(self, dag: Any):
+        self.dag = dag
+        self.__columns: dict[str, np.ndarray] = {}
+        self.__sorted_indexes: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.dag.edges)
+
+    def get_column(self, name: str) -> np.ndarray:
+        if name not in self.__columns:
+            self.__columns[name] = self.__extract_column(name)
+        return self.__columns[name]
+
+    def get_sorted_index(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        if name not in self.__sorted_indexes:
+            column = self.get_column(name)
+            order = np.argsort(column, kind='stable')
+            self.__sorted_indexes[name] = order, column[order]
+        return self.__sorted_indexes[name]
+
+    def select(self, **predicates: Predicate) -> np.ndarray:
+        mask = np.ones(len(self), dtype=bool)
+        for name, predicate in predicates.items():
+            mask &= self.__evaluate(name, predicate)
+        return np.flatnonzero(mask)
+
+    def get_edges(self, indices: np.ndarray) -> list:
+        return [self.dag.edges[x] for x in np.asarray(indices).tolist()]
+
+    def to_numpy(self, columns: list[str], indices: np.ndarray = None) -> dict[str, np.ndarray]:
+        return {x: self.get_column(x) if indices is None else self.get_column(x)[indices] for x in columns}
+
+    def to_frame(self, columns: list[str], indices: np.ndarray = None) -> Any:
+        import pandas as pd
+        frame = pd.DataFrame(self.to_numpy(columns, indices))
+        frame.insert(0, 'case', self.dag.id)
+        frame.index = np.arange(len(self)) if indices is None else np.asarray(indices)
+        return frame
+
+    def aggregate(self, column: str, by: str = 'generation', statistics: tuple[str, ...] = DEFAULT_STATISTICS,
+                  quantiles: tuple[float, ...] = DEFAULT_QUANTILES, indices: np.ndarray = None,
+                  as_frame: bool = False) -> Any:
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        keys, values = self.get_column(by)[indices], self.get_column(column)[indices].astype(float)
+        valid = ~np.isnan(values)
+        keys, values = keys[valid], values[valid]
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+        groups, starts = np.unique(keys, return_index=True)
+        counts = np.diff(np.append(starts, len(keys)))
+        result = {by: groups}
+        if len(groups) > 0:
+            sums = np.add.reduceat(values, starts)
+            means = sums / counts
+            squares = np.add.reduceat((values - np.repeat(means, counts)) ** 2, starts)
+            computed = {'count': counts, 'sum': sums, 'mean': means, 'std': np.sqrt(squares / counts),
+                        'min': np.minimum.reduceat(values, starts), 'max': np.maximum.reduceat(values, starts)}
+        else:
+            computed = {x: np.zeros(0) for x in ['count', 'sum', 'mean', 'std', 'min', 'max']}
+        for name in statistics:
+            if name not in computed:
+                raise ValueError(f'Unknown statistic {name}, available statistics: {list(computed.keys())}')
+            result[name] = computed[name]
+        for quantile in quantiles:
+            result[f'q{quantile:g}'] = np.array([np.quantile(values[begin:begin + count], quantile)
+                                                 for begin, count in zip(starts, counts)])
+        if as_frame:
+            import pandas as pd
+            return pd.DataFrame(result)
+        return result
+
+    def __evaluate(self, name: str, predicate: Predicate) -> np.ndarray:
+        if callable(predicate):
+            return np.asarray(predicate(self.get_column(name)), dtype=bool)
+        if isinstance(predicate, tuple):
+            low, high = predicate
+            order, sorted_values = self.get_sorted_index(name)
+            begin = 0 if low is None else np.searchsorted(sorted_values, low, side='left')
+            end = len(sorted_values) if high is None else np.searchsorted(sorted_values, high, side='right')
+            mask = np.zeros(len(self), dtype=bool)
+            mask[order[begin:end]] = True
+            return mask
+        return self.get_column(name) == predicate
+
+    def __extract_column(self, name: str) -> np.ndarray:
+        if name == 'depth':
+            depths = np.zeros(len(self), dtype=np.int64)
+            traversal = self.dag.get_traversal()
+            depths[traversal.edges] = traversal.depths
+            return depths
+        if name in EDGE_METRICS:
+            return self.dag.get_tree_metrics().edge[name]
+        if name in EDGE_DATA_COLUMNS and hasattr(self.dag, 'get_edge_field'):
+            return np.array(self.dag.get_edge_field(EDGE_DATA_COLUMNS[name]), copy=True)
+        if hasattr(self.dag, 'edge_attributes') and isinstance(self.dag.edge_attributes.columns.get(name, None),
+                                                               ArrayColumn):
+            column = self.dag.edge_attributes.columns[name]
+            if column.values.ndim == 1 and column.present is None and column.nulls is None:
+                return column.values.copy()
+        if name in EDGE_DATA_COLUMNS:
+            values = [getattr(edge.edge_data, EDGE_DATA_COLUMNS[name]) for edge in self.dag.edges]
+        else:
+            values = [edge.data.get(name, None) for edge in self.dag.edges]
+        if all(x is None or np.isscalar(x) for x in values):
+            non_null = [x for x in values if x is not None]
+            if len(non_null) == 0 or all(isinstance(x, (bool, int, float, np.number, np.bool_)) for x in non_null):
+                dtype = np.array(non_null).dtype if len(non_null) > 0 else np.float64
+                if len(non_null) < len(values):
+                    dtype = np.result_type(dtype, np.float64)
+                return np.array([np.nan if x is None else x for x in values], dtype=dtype)
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
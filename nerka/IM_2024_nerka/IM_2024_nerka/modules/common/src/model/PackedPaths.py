@@ -0,0 +1,30 @@
+from typing import Any
+
+import numpy as np
+
+from modules.common.src.model.AttributeStore import RaggedColumn
+
+
+def get_packed_voxels(dag: Any) -> tuple[np.ndarray, np.ndarray]:
+    column = dag.edge_attributes.columns.get('voxels', None) if hasattr(dag, 'edge_attributes') else None
+    if isinstance(column, RaggedColumn) and column.present is None:
+        return column.values.reshape(-1, 3).astype(np.int64, copy=False), np.diff(column.offsets) // 3
+    voxels = [np.asarray(edge.data['voxels'] if 'voxels' in edge.data else [], dtype=np.int64).reshape(-1, 3)
+              for edge in dag.edges]
+    counts = np.array([len(x) for x in voxels], dtype=np.int64)
+    return (np.concatenate(voxels) if len(voxels) > 0 else np.zeros((0, 3), dtype=np.int64)), counts
+
+
+def get_packed_paths(dag: Any) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    adjacency = dag.get_adjacency()
+    node_coords = np.array([node.coords for node in dag.nodes], dtype=np.int64).reshape(-1, 3) \
+        if not hasattr(dag, 'node_coords') else dag.node_coords
+    voxels, voxel_counts = get_packed_voxels(dag)
+    edge_count = len(adjacency.edge_nodes)
+    path_offsets = np.concatenate([[0], np.cumsum(voxel_counts + 2)]).astype(np.int64)
+    paths = np.empty((path_offsets[-1], 3), dtype=np.int64)
+    paths[path_offsets[:-1]] = node_coords[adjacency.edge_nodes[:, 0]]
+    paths[path_offsets[1:] - 1] = node_coords[adjacency.edge_nodes[:, 1]]
+    voxel_edges = np.repeat(np.arange(edge_count), voxel_counts)
+    paths[np.arange(len(voxels)) + 2 * voxel_edges + 1] = voxels
+    return paths, path_offsets, voxel_counts
@@ -0,0 +1,127 @@
+from typing import Any
+
+import numpy as np
+
+from modules.common.src.model.VolumeData import VolumeData
+
+
+class SparseVolume:
+    __array_priority__ = 1
+
+    def __init__(self, shape: tuple, coords: np.ndarray, values: np.ndarray):
+        self.shape = tuple(int(x) for x in shape)
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, len(self.shape))
+        values = np.asarray(values)
+        linear_indices = np.ravel_multi_index(tuple(coords.T), self.shape) if len(coords) > 0 else np.zeros(0, np.int64)
+        order = np.argsort(linear_indices, kind='stable')
+        self.coords = coords[order]
+        self.values = values[order]
+        self.linear_indices = linear_indices[order]
+
+    @staticmethod
+    def from_dense(volume: np.ndarray) -> 'SparseVolume':
+        volume = np.asarray(volume)
+        coords = np.argwhere(volume != 0)
+        return SparseVolume(volume.shape, coords, volume[tuple(coords.T)])
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.values.dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nnz(self) -> int:
+        return len(self.values)
+
+    @property
+    def nbytes(self) -> int:
+        return self.coords.nbytes + self.values.nbytes + self.linear_indices.nbytes
+
+    def to_dense(self) -> VolumeData:
+        volume = np.zeros(self.shape, dtype=self.dtype)
+        volume.flat[self.linear_indices] = self.values
+        return volume.view(VolumeData)
+
+    def lookup(self, coords: np.ndarray) -> np.ndarray:
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, self.ndim)
+        inside = np.all((coords >= 0) & (coords < self.shape), axis=1)
+        result = np.zeros(len(coords), dtype=self.dtype)
+        if self.nnz == 0:
+            return result
+        linear_indices = np.ravel_multi_index(tuple(coords[inside].T), self.shape)
+        positions = np.minimum(np.searchsorted(self.linear_indices, linear_indices), self.nnz - 1)
+        found = self.linear_indices[positions] == linear_indices
+        inside_result = np.zeros(len(linear_indices), dtype=self.dtype)
+        inside_result[found] = self.values[positions[found]]
+        result[inside] = inside_result
+        return result
+
+    def get_region(self, slices: tuple[slice, ...]) -> VolumeData:
+        ranges = [x.indices(size) for x, size in zip(slices, self.shape)]
+        if any(step != 1 for _, _, step in ranges):
+            return self.to_dense()[slices]
+        start = np.array([begin for begin, _, _ in ranges])
+        stop = np.array([max(end, begin) for begin, end, _ in ranges])
+        region = np.zeros(tuple(stop - start), dtype=self.dtype)
+        if self.nnz > 0 and region.size > 0:
+            first = np.searchsorted(self.linear_indices, np.ravel_multi_index(tuple(start), self.shape))
+            last = np.searchsorted(self.linear_indices, np.ravel_multi_index(tuple(stop - 1), self.shape), side='right')
+            coords = self.coords[first:last]
+            inside = np.all((coords >= start) & (coords < stop), axis=1)
+            region[tuple((coords[inside] - start).T)] = self.values[first:last][inside]
+        return region.view(VolumeData)
+
+    def argwhere(self) -> np.ndarray:
+        return self.coords[self.values != 0]
+
+    def astype(self, dtype: Any) -> 'SparseVolume':
+        return SparseVolume(self.shape, self.coords, self.values.astype(dtype))
+
+    def max(self) -> Any:
+        return self.values.max(initial=0) if self.nnz < self.size else self.values.max()
+
+    def min(self) -> Any:
+        return self.values.min(initial=0) if self.nnz < self.size else self.values.min()
+
+    def __getitem__(self, key: Any) -> Any:
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) == self.ndim and all(isinstance(x, (int, np.integer)) for x in key):
+            return self.lookup(np.array(key))[0]
+        if all(isinstance(x, slice) for x in key):
+            return self.get_region(key + (slice(None),) * (self.ndim - len(key)))
+        return self.to_dense()[key]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        volume = self.to_dense()
+        return volume if dtype is None else volume.astype(dtype)
+
+    def __gt__(self, other: Any) -> np.ndarray:
+        return np.asarray(self) > other
+
+    def __ge__(self, other: Any) -> np.ndarray:
+        return np.asarray(self) >= other
+
+    def __lt__(self, other: Any) -> np.ndarray:
+        return np.asarray(self) < other
+
+    def __le__(self, other: Any) -> np.ndarray:
+        return np.asarray(self) <= other
+
+    def __eq__(self, other: Any) -> np.ndarray:
+        return np.asarray(self) == other
+
+    def __ne__(self, other: Any) -> np.ndarray:
+        return np.asarray(self) != other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'SparseVolume(shape={self.shape}, dtype={self.dtype}, nnz={self.nnz})'
@@ -0,0 +1,78 @@
+from typing import Any
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from modules.common.src.model.PackedPaths import get_packed_paths
+
+
+class SpatialIndex:
+
+    def __init__(self, dag: Any):
+        self.dag = dag
+        self.node_coords = np.array([node.coords for node in dag.nodes], dtype=np.int64).reshape(-1, 3) \
+            if not hasattr(dag, 'node_coords') else dag.node_coords
+        paths, path_offsets, _ = get_packed_paths(dag)
+        self.voxel_coords = paths
+        self.voxel_edges = np.repeat(np.arange(len(path_offsets) - 1), np.diff(path_offsets))
+        self.__node_tree = None
+        self.__voxel_tree = None
+
+    def get_node_tree(self) -> cKDTree:
+        if self.__node_tree is None:
+            self.__node_tree = cKDTree(self.node_coords)
+        return self.__node_tree
+
+    def get_voxel_tree(self) -> cKDTree:
+        if self.__voxel_tree is None:
+            self.__voxel_tree = cKDTree(self.voxel_coords)
+        return self.__voxel_tree
+
+    def nearest_nodes(self, points: Any, max_distance: float = np.inf) -> tuple[np.ndarray, np.ndarray]:
+        return self.__nearest(self.get_node_tree(), np.arange(len(self.node_coords)), points, max_distance)
+
+    def nearest_edges(self, points: Any, max_distance: float = np.inf) -> tuple[np.ndarray, np.ndarray]:
+        return self.__nearest(self.get_voxel_tree(), self.voxel_edges, points, max_distance)
+
+    def nodes_within(self, points: Any, radius: float) -> list[np.ndarray]:
+        points = _as_points(points)
+        if len(self.node_coords) == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in points]
+        return [np.sort(np.asarray(x, dtype=np.int64)) for x in self.get_node_tree().query_ball_point(points, radius)]
+
+    def edges_within(self, points: Any, radius: float) -> list[np.ndarray]:
+        points = _as_points(points)
+        if len(self.voxel_coords) == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in points]
+        return [np.unique(self.voxel_edges[np.asarray(x, dtype=np.int64)])
+                for x in self.get_voxel_tree().query_ball_point(points, radius)]
+
+    def nodes_in_box(self, low: Any, high: Any) -> np.ndarray:
+        return np.flatnonzero(_in_box(self.node_coords, low, high))
+
+    def edges_in_box(self, low: Any, high: Any) -> np.ndarray:
+        return np.unique(self.voxel_edges[_in_box(self.voxel_coords, low, high)])
+
+    def get_nodes(self, indices: np.ndarray) -> list:
+        return [None if x < 0 else self.dag.nodes[x] for x in np.asarray(indices).tolist()]
+
+    def get_edges(self, indices: np.ndarray) -> list:
+        return [None if x < 0 else self.dag.edges[x] for x in np.asarray(indices).tolist()]
+
+    @staticmethod
+    def __nearest(tree: cKDTree, labels: np.ndarray, points: Any,
+                  max_distance: float) -> tuple[np.ndarray, np.ndarray]:
+        points = _as_points(points)
+        if tree.n == 0:
+            return np.full(len(points), np.inf), np.full(len(points), -1, dtype=np.int64)
+        distances, indices = tree.query(points, k=1, distance_upper_bound=max_distance)
+        found = indices < tree.n
+        return distances, np.where(found, labels[np.minimum(indices, tree.n - 1)], -1)
+
+
+def _as_points(points: Any) -> np.ndarray:
+    return np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+
+def _in_box(coords: np.ndarray, low: Any, high: Any) -> np.ndarray:
+    return np.all((coords >= np.asarray(low)) & (coords <= np.asarray(high)), axis=1)
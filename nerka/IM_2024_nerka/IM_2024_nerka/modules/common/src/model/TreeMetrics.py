@@ -0,0 +1,94 @@
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+EDGE_METRICS = ['subtree_length', 'subtree_volume', 'leaf_count', 'strahler_order', 'path_length', 'path_tortuosity']
+NODE_METRICS = ['subtree_length', 'subtree_volume', 'leaf_count', 'strahler_order', 'path_length']
+
+
+@dataclass
+class TreeMetrics:
+    edge: dict[str, np.ndarray]
+    node: dict[str, np.ndarray]
+
+
+def compute_tree_metrics(dag: Any) -> TreeMetrics:
+    adjacency = dag.get_adjacency()
+    traversal = dag.get_traversal()
+    table = dag.get_edge_table()
+    edge_count, node_count = len(adjacency.edge_nodes), len(adjacency.node_edge_offsets) - 1
+    edges, parents = traversal.edges, traversal.parent_edges
+    node_coords = np.array([node.coords for node in dag.nodes], dtype=np.float64).reshape(-1, 3) \
+        if not hasattr(dag, 'node_coords') else dag.node_coords.astype(np.float64)
+
+    lengths = np.nan_to_num(table.get_column('length').astype(np.float64))
+    end_to_end = np.linalg.norm(node_coords[adjacency.edge_nodes[:, 1]] - node_coords[adjacency.edge_nodes[:, 0]],
+                                axis=1)
+    lengths = np.where(lengths > 0, lengths, end_to_end)
+    radii = np.nan_to_num(table.get_column('thickness').astype(np.float64))
+
+    edge_metrics = {x: np.full(edge_count, np.nan) for x in EDGE_METRICS}
+    subtree_length = np.zeros(edge_count)
+    subtree_volume = np.zeros(edge_count)
+    leaf_count = np.zeros(edge_count, dtype=np.int64)
+    strahler_order = np.zeros(edge_count, dtype=np.int64)
+    child_max = np.zeros(edge_count, dtype=np.int64)
+    child_max_count = np.zeros(edge_count, dtype=np.int64)
+    child_count = np.zeros(edge_count, dtype=np.int64)
+    np.add.at(child_count, parents[parents >= 0], 1)
+    subtree_length[edges] = lengths[edges]
+    volumes = np.pi * radii ** 2 * lengths
+    subtree_volume[edges] = volumes[edges]
+
+    level_bounds = np.searchsorted(traversal.depths, np.arange(1, traversal.depths.max(initial=0) + 2))
+    levels = [slice(begin, end) for begin, end in zip(level_bounds[:-1], level_bounds[1:])]
+    for level in reversed(levels):
+        level_edges, level_parents = edges[level], parents[level]
+        leaf_count[level_edges] = np.where(child_count[level_edges] == 0, 1, leaf_count[level_edges])
+        strahler_order[level_edges] = _get_strahler_order(child_count[level_edges], child_max[level_edges],
+                                                          child_max_count[level_edges])
+        with_parent = level_parents >= 0
+        level_edges, level_parents = level_edges[with_parent], level_parents[with_parent]
+        np.add.at(subtree_length, level_parents, subtree_length[level_edges])
+        np.add.at(subtree_volume, level_parents, subtree_volume[level_edges])
+        np.add.at(leaf_count, level_parents, leaf_count[level_edges])
+        np.maximum.at(child_max, level_parents, strahler_order[level_edges])
+        np.add.at(child_max_count, level_parents, strahler_order[level_edges] == child_max[level_parents])
+
+    path_length = np.zeros(edge_count)
+    for level in levels:
+        level_edges, level_parents = edges[level], parents[level]
+        path_length[level_edges] = lengths[level_edges] + np.where(level_parents >= 0, path_length[level_parents], 0)
+
+    root_coords = node_coords[adjacency.root] if adjacency.root >= 0 else np.zeros(3)
+    distances = np.linalg.norm(node_coords[adjacency.edge_nodes[edges, 1]] - root_coords, axis=1)
+    edge_metrics['subtree_length'][edges] = subtree_length[edges]
+    edge_metrics['subtree_volume'][edges] = subtree_volume[edges]
+    edge_metrics['leaf_count'][edges] = leaf_count[edges]
+    edge_metrics['strahler_order'][edges] = strahler_order[edges]
+    edge_metrics['path_length'][edges] = path_length[edges]
+    edge_metrics['path_tortuosity'][edges] = np.divide(path_length[edges], distances, out=np.full(len(edges), np.nan),
+                                                       where=distances > 0)
+
+    node_metrics = {x: np.full(node_count, np.nan) for x in NODE_METRICS}
+    children = adjacency.edge_nodes[edges, 1]
+    for name in ['leaf_count', 'strahler_order', 'path_length']:
+        node_metrics[name][children] = edge_metrics[name][edges]
+    node_metrics['subtree_length'][children] = subtree_length[edges] - lengths[edges]
+    node_metrics['subtree_volume'][children] = subtree_volume[edges] - volumes[edges]
+    if adjacency.root >= 0:
+        root_edges = edges[parents < 0]
+        node_metrics['subtree_length'][adjacency.root] = subtree_length[root_edges].sum()
+        node_metrics['subtree_volume'][adjacency.root] = subtree_volume[root_edges].sum()
+        node_metrics['leaf_count'][adjacency.root] = leaf_count[root_edges].sum() if len(root_edges) > 0 else 1
+        node_metrics['path_length'][adjacency.root] = 0
+        orders = strahler_order[root_edges]
+        node_metrics['strahler_order'][adjacency.root] = _get_strahler_order(
+            np.array([len(orders)]), np.array([orders.max(initial=0)]),
+            np.array([np.sum(orders == orders.max(initial=0))]))[0]
+    return TreeMetrics(edge_metrics, node_metrics)
+
+
+def _get_strahler_order(child_count: np.ndarray, child_max: np.ndarray, child_max_count: np.ndarray) -> np.ndarray:
+    return np.where(child_count == 0, 1, np.where(child_max_count >= 2, child_max + 1, child_max))
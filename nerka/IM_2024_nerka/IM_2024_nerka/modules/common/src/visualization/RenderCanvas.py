@@ -0,0 +1,38 @@
+import numpy as np
+
+
+class RenderCanvas:
+
+    def __init__(self, shape: tuple, dtype: np.dtype = np.uint8, buffer: np.ndarray = None, clear: bool = True):
+        shape, dtype = tuple(int(x) for x in shape), np.dtype(dtype)
+        if buffer is None:
+            buffer = np.zeros(shape, dtype=dtype)
+        elif buffer.shape != shape or buffer.dtype != dtype:
+            raise ValueError(f'Buffer of shape {buffer.shape} and type {buffer.dtype} cannot be used as canvas of '
+                             f'shape {shape} and type {dtype}')
+        elif clear:
+            buffer.fill(0)
+        self.image = buffer
+
+    @property
+    def shape(self) -> tuple:
+        return self.image.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.image.dtype
+
+    def clear(self) -> None:
+        self.image.fill(0)
+
+    def set_voxels(self, coords: np.ndarray, values: any) -> None:
+        coords = np.asarray(coords)
+        coords = (coords if coords.dtype.kind in 'iu' else coords.astype(np.int64)).reshape(-1, 3)
+        inside = np.all((coords >= 0) & (coords < self.image.shape), axis=1)
+        values = np.asarray(values)
+        self.image[tuple(coords[inside].T)] = values[inside] if values.ndim > 0 else values
+
+    def set_box(self, low: tuple, high: tuple, value: any) -> None:
+        low = [max(int(x), 0) for x in low]
+        high = [max(int(x), 0) for x in high]
+        self.image[low[0]:high[0], low[1]:high[1], low[2]:high[2]] = value
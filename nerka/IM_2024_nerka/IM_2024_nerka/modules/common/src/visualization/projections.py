@@ -4,20 +4,39 @@ import numpy as np
 from matplotlib import pyplot as plt
 
 from modules.common.src.app_utils.Logger import get_logger
+from modules.common.src.app_utils.ProductCache import ProductCache
+from modules.common.src.app_utils.Reader import Reader
 from modules.common.src.model import Edge
 from modules.common.src.model import DAG
+from modules.common.src.model.PackedPaths import get_packed_voxels
 from modules.common.src.model.VolumeData import VolumeData
 
 
+PROJECTION_MODES = ('max', 'mean', 'sum')
+DEFAULT_CHUNK_VOXELS = 2 ** 24
+
+
 class AbstractPixelGenerator:
     name: str = ''
 
     def get_volume(self):
         volume = np.zeros(self.get_shape())
-        for voxel in self.get_voxels():
-            volume[voxel] = self.get_color(voxel)
+        coords, values = self.get_pixels()
+        volume[tuple(coords.T)] = values
         return volume
 
+    def get_pixels(self, projections=None) -> tuple[np.ndarray, np.ndarray]:
+        voxels = self.get_voxels(projections)
+        coords = np.array([tuple(x) for x in voxels], dtype=np.int64).reshape(-1, 3)
+        return coords, np.array([self.get_color(tuple(x)) for x in coords.tolist()])
+
+    def get_projections(self, mode: str = 'max', chunk_size: int = None) -> list[np.ndarray]:
+        projections = []
+        for projection in (0, 1, 2):
+            coords, values = self.get_pixels(projection)
+            projections.append(project_pixels(coords, values, self.get_shape(), projection, mode, chunk_size))
+        return projections
+
     def set_name(self, name: str) -> None:
         self.name = name
 
@@ -59,15 +78,18 @@ class DAGBasedPixelGenerator(AbstractPixelGenerator):
         return tuple(map(lambda i, j: i + j, self.dag.get_shape(), (2, 2, 2)))
 
     def get_voxels(self, projections=None) -> list[tuple]:
-        pixel_list = []
-        for e in self.dag.edges:
-            for voxel in e['voxels']:
-                color = self.color_function(e)
-                if color < self.color_limit:
-                    pixel_list.append(voxel)
-                    self.color_map[voxel] = color
+        coords, values = self.get_pixels(projections)
+        pixel_list = list(map(tuple, coords.tolist()))
+        self.color_map.update(zip(pixel_list, values.tolist()))
         return pixel_list
 
+    def get_pixels(self, projections=None) -> tuple[np.ndarray, np.ndarray]:
+        voxels, counts = get_packed_voxels(self.dag)
+        colors = np.array([self.color_function(e) for e in self.dag.edges])
+        values = np.repeat(colors, counts)
+        visible = values < self.color_limit
+        return voxels[visible], values[visible]
+
 
 class VolumeBasedPixelGenerator(AbstractPixelGenerator):
 
@@ -80,6 +102,13 @@ class VolumeBasedPixelGenerator(AbstractPixelGenerator):
     def get_voxels(self, projections=None) -> np.ndarray:
         return np.argwhere(self.volume > 0)
 
+    def get_pixels(self, projections=None) -> tuple[np.ndarray, np.ndarray]:
+        coords = np.argwhere(self.volume > 0)
+        return coords, np.ones(len(coords))
+
+    def get_projections(self, mode: str = 'max', chunk_size: int = None) -> list[np.ndarray]:
+        return project_volume(self.volume, mode, chunk_size, binary=True)
+
     def get_shape(self) -> tuple:
         return self.volume.shape
 
@@ -93,20 +122,19 @@ class SingleSlicePixelGenerator(AbstractPixelGenerator):
         return 'Greys'
 
     def get_voxels(self, projections=None) -> list[tuple]:
-        voxels = []
-        if projections == 2:
-            for i in range(self.volume.shape[0]):
-                for j in range(self.volume.shape[1]):
-                    voxels.append((i, j, self.slice_no))
-        elif projections == 1:
-            for i in range(self.volume.shape[0]):
-                for j in range(self.volume.shape[1]):
-                    voxels.append((i, self.slice_no, j))
-        else:
-            for i in range(self.volume.shape[1]):
-                for j in range(self.volume.shape[2]):
-                    voxels.append((self.slice_no, i, j))
-        return voxels
+        return list(map(tuple, self.get_slice_coords(projections).tolist()))
+
+    def get_pixels(self, projections=None) -> tuple[np.ndarray, np.ndarray]:
+        coords = self.get_slice_coords(projections)
+        return coords, np.asarray(self.volume[tuple(coords.T)])
+
+    def get_slice_coords(self, projections=None) -> np.ndarray:
+        axis = projections if projections in (1, 2) else 0
+        shape = list(self.volume.shape)
+        shape[axis] = 1
+        coords = np.indices(shape).reshape(3, -1).T
+        coords[:, axis] = self.slice_no
+        return coords
 
     def get_shape(self) -> tuple:
         return self.volume.shape
@@ -130,32 +158,97 @@ class PixelProviderFactory:
         raise NotImplementedError()
 
 
-def plot_as_2d_projection(pixel_generator: AbstractPixelGenerator, coords_to_highlight: np.ndarray = None, max_value=np.inf) -> any:
+def plot_as_2d_projection(pixel_generator: AbstractPixelGenerator, coords_to_highlight: np.ndarray = None, max_value=np.inf,
+                          mode: str = 'max') -> any:
+    projections = get_2d_projections(pixel_generator, coords_to_highlight, mode)
+    return plot_projections(projections, pixel_generator.get_colormap(), pixel_generator.get_name(), max_value)
+
+
+def get_source_projections(source: any, coords_to_highlight: np.ndarray = None) -> list[np.ndarray]:
+    return get_2d_projections(PixelProviderFactory.get_pixel_factory(source), coords_to_highlight)
+
+
+def get_cached_source_projections(reader: Reader, step: Reader.DataStep = Reader.DataStep.DAG_WITH_STATS_FILENAME,
+                                  coords_to_highlight: np.ndarray = None) -> list[np.ndarray]:
+    return ProductCache(reader).get_or_compute(step, get_source_projections, coords_to_highlight)
+
+
+def get_2d_projections(pixel_generator: AbstractPixelGenerator, coords_to_highlight: np.ndarray = None,
+                       mode: str = 'max', chunk_size: int = None) -> list[np.ndarray]:
+    projections = pixel_generator.get_projections(mode, chunk_size)
+    for projection, plot in enumerate(projections):
+        __draw_highlighted_nodes(projection, coords_to_highlight, plot)
+    return projections
+
+
+def project_pixels(coords: np.ndarray, values: np.ndarray, shape: tuple, axis: int, mode: str = 'max',
+                   chunk_size: int = None) -> np.ndarray:
+    if mode not in PROJECTION_MODES:
+        raise ValueError(f'Unknown projection mode {mode}, available modes: {PROJECTION_MODES}')
+    slice_shape = tuple(int(x) for i, x in enumerate(shape) if i != axis)
+    plot = np.zeros(slice_shape)
+    counts = np.zeros(slice_shape, dtype=np.int64) if mode == 'mean' else None
+    chunk_size = max(len(coords), 1) if chunk_size is None else chunk_size
+    outside = 0
+    for begin in range(0, len(coords), chunk_size):
+        pixels = np.delete(np.asarray(coords[begin:begin + chunk_size]), axis, axis=1)
+        chunk_values = np.asarray(values[begin:begin + chunk_size], dtype=np.float64)
+        inside = np.all((pixels >= 0) & (pixels < slice_shape), axis=1)
+        outside += int(np.sum(~inside))
+        pixels = tuple(pixels[inside].T)
+        if mode == 'max':
+            np.maximum.at(plot, pixels, chunk_values[inside])
+        else:
+            np.add.at(plot, pixels, chunk_values[inside])
+            if counts is not None:
+                np.add.at(counts, pixels, chunk_values[inside] != 0)
+    if outside > 0:
+        get_logger().warning(f'{outside} pixels are out of plot shape: {plot.shape}')
+    if counts is not None:
+        np.divide(plot, counts, out=plot, where=counts > 0)
+    return plot
+
+
+def project_volume(volume: any, mode: str = 'max', chunk_size: int = None, binary: bool = False) -> list[np.ndarray]:
+    if mode not in PROJECTION_MODES:
+        raise ValueError(f'Unknown projection mode {mode}, available modes: {PROJECTION_MODES}')
+    shape = tuple(int(x) for x in volume.shape)
+    chunk_size = max(DEFAULT_CHUNK_VOXELS // max(shape[1] * shape[2], 1), 1) if chunk_size is None else chunk_size
+    projections = [np.zeros((shape[1], shape[2])), np.zeros((shape[0], shape[2])), np.zeros((shape[0], shape[1]))]
+    counts = [np.zeros(x.shape, dtype=np.int64) for x in projections] if mode == 'mean' else None
+    for begin in range(0, shape[0], chunk_size):
+        chunk = np.asarray(volume[begin:begin + chunk_size])
+        chunk = chunk > 0 if binary else chunk
+        rows = slice(begin, begin + len(chunk))
+        if mode == 'max':
+            np.maximum(projections[0], np.max(chunk, axis=0), out=projections[0])
+            projections[1][rows] = np.max(chunk, axis=1)
+            projections[2][rows] = np.max(chunk, axis=2)
+        else:
+            projections[0] += np.sum(chunk, axis=0, dtype=np.float64)
+            projections[1][rows] = np.sum(chunk, axis=1, dtype=np.float64)
+            projections[2][rows] = np.sum(chunk, axis=2, dtype=np.float64)
+        if counts is not None:
+            counts[0] += np.count_nonzero(chunk, axis=0)
+            counts[1][rows] = np.count_nonzero(chunk, axis=1)
+            counts[2][rows] = np.count_nonzero(chunk, axis=2)
+    if counts is not None:
+        for projection, count in zip(projections, counts):
+            np.divide(projection, count, out=projection, where=count > 0)
+    return projections
+
+
+def plot_projections(projections: list[np.ndarray], colormap: str, title: str = '', max_value=np.inf) -> any:
     fig, axs = plt.subplots(nrows=1, ncols=3, figsize=(12, 4))
-    plt.title(pixel_generator.get_name())
-    for projection in (0, 1, 2):
+    plt.title(title)
+    for projection, plot in enumerate(projections):
         plt.sca(axs[projection])
-        slice_shape = list(pixel_generator.get_shape())
-        del slice_shape[projection]
-        plot = np.zeros(slice_shape)
-        voxels = pixel_generator.get_voxels(projection)
-        for voxel in voxels:
-            pixel = __get_2d_pixel(projection, voxel)
-            try:
-                plot[pixel] = max(plot[pixel], pixel_generator.get_color(voxel))
-            except IndexError as e:
-                get_logger().warning(f'Pixel: {pixel} is out of plot shape: {plot.shape}')
-        __draw_highlighted_nodes(projection, coords_to_highlight, plot)
         points = np.argwhere((plot > 0))
-        colors = []
-        for p in points:
-            c = plot[p[0], p[1]]
-            if c <= max_value:
-                colors.append(c)
-            else:
-                colors.append(0)
-        colors[0] = 0  # Setting to zero to ensure colormap starting from zero
-        plt.scatter(points[:, 0], points[:, 1], c=colors, s=(72. / fig.dpi) ** 2, lw=0, marker='^', cmap=pixel_generator.get_colormap())
+        colors = plot[tuple(points.T)]
+        colors = np.where(colors <= max_value, colors, 0)
+        if len(colors) > 0:
+            colors[0] = 0  # Setting to zero to ensure colormap starting from zero
+        plt.scatter(points[:, 0], points[:, 1], c=colors, s=(72. / fig.dpi) ** 2, lw=0, marker='^', cmap=colormap)
     return plt
 
 
@@ -177,12 +270,8 @@ def __draw_highlighted_nodes(axes: int, coords_to_highlight: np.ndarray, plot):
 
 
 def __draw_root(plot: np.ndarray, coords: tuple) -> None:
-    for i in range(-10, 10):
-        for j in range(-10, 10):
-            try:
-                plot[tuple(map(lambda x, y: x + y, coords, (i, j)))] = 2
-            except IndexError:
-                pass
+    x, y = (int(i) for i in coords)
+    plot[max(x - 10, 0):max(x + 10, 0), max(y - 10, 0):max(y + 10, 0)] = 2
 
 
 def plot_2d_image(image: np.ndarray) -> None:
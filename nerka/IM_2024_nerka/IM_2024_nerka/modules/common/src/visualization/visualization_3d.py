@@ -1,12 +1,18 @@
+from functools import cache
+from typing import Iterator
+
 import numpy as np
 from skimage import morphology
-from skimage.draw import line_nd
 
+from modules.common.src.app_utils.ProductCache import ProductCache
+from modules.common.src.app_utils.Reader import Reader
 from modules.common.src.visualization.ColorMapVisualizer import ColorMapVisualizer
+from modules.common.src.visualization.RenderCanvas import RenderCanvas
 from modules.common.src.visualization.VolumeVisualizer import VolumeVisualizer
 from modules.common.src.model import DAG
 from modules.common.src.model.VolumeData import VolumeData
 
+SPHERE_CHUNK_VOXELS = 2 ** 20
 
 # TODO: Major refactoring
 
@@ -14,116 +20,175 @@ def visualize_dag(dag: DAG, edge_size='mean_thickness', fixed_node_size: int = 0
     visualize_lsd(get_dag_visualisation(dag, edge_size, fixed_node_size, edges_to_highlight))
 
 
-def get_dag_visualisation(dag: DAG, edge_size='mean_thickness', fixed_node_size: int = 0, edges_to_highlight=None) -> VolumeData:
+def get_dag_visualisation(dag: DAG, edge_size='mean_thickness', fixed_node_size: int = 0, edges_to_highlight=None,
+                          dtype: np.dtype = np.uint8, buffer: np.ndarray = None) -> VolumeData:
     if edges_to_highlight is None:
         edges_to_highlight = []
-    visualization = np.zeros(dag.get_shape())
+    canvas = RenderCanvas(dag.get_shape(), dtype, buffer)
+
+    draw_nodes(canvas, dag.nodes, fixed_node_size)
+    draw_edges(canvas, dag.edges, edge_size=edge_size, edges_to_highlight=edges_to_highlight)
+    return canvas.image
+
 
-    visualization = draw_nodes(visualization, dag.nodes, fixed_node_size)
-    visualization = draw_edges(visualization, dag.edges, edge_size=edge_size, edges_to_highlight=edges_to_highlight)
-    return visualization
+def get_cached_dag_visualisation(reader: Reader, step: Reader.DataStep = Reader.DataStep.DAG_WITH_STATS_FILENAME,
+                                 edge_size='mean_thickness', fixed_node_size: int = 0, edges_to_highlight=None,
+                                 dtype: np.dtype = np.uint8) -> VolumeData:
+    return ProductCache(reader).get_or_compute(step, get_dag_visualisation, edge_size, fixed_node_size,
+                                               edges_to_highlight, dtype)
 
 
 def draw_nodes(image, nodes, value):
-    nodes_image = __print_kernels(image, nodes, value)
-    return nodes_image
+    canvas = __get_canvas(image)
+    __print_kernels(canvas, nodes, value)
+    return __get_result(image, canvas)
 
 
 def draw_directions(image, edges, start_value=2, end_value=3, length=10):
-    image = image.copy()
-
+    canvas = __get_canvas(image)
+    upper = np.array(image.shape) - 1
+    starts, ends, values = [], [], []
     for edge in edges:
-        start_point = edge.node_a['centroid']
-        end_point = start_point + length * edge['start_direction']
-        end_point = np.maximum([0, 0, 0], end_point)
-        end_point = np.minimum(np.array(image.shape) - 1, end_point)
-        image[line_nd(start_point, end_point)] = start_value
-
-        start_point = edge.node_b['centroid']
-        end_point = start_point + length * edge['end_direction']
-        end_point = np.maximum([0, 0, 0], end_point)
-        end_point = np.minimum(np.array(image.shape) - 1, end_point)
-        image[line_nd(start_point, end_point)] = end_value
-
-    return image
-
-
-def __print_kernels(image, nodes, value):
-    image = image.copy()
-    max_kernel_radius = int(max([node['thickness'] for node in nodes]))
-    kernels = [__spherical_kernel(radius) for radius in range(max_kernel_radius + 1)]
-
-    padded_image = np.pad(image, max_kernel_radius)
-    kernels_image = np.zeros(padded_image.shape)
-
-    for node in nodes:
-        x, y, z = (coord + max_kernel_radius for coord in node.coords)
-        if value != 0:
-            kernel_radius = value
-        else:
-            kernel_radius = int(node['thickness'])
-        kernel = kernels[kernel_radius]
-
-        mask_slice = kernels_image[
-                     x - kernel_radius:x + kernel_radius + 1,
-                     y - kernel_radius:y + kernel_radius + 1,
-                     z - kernel_radius:z + kernel_radius + 1
-                     ]
-
-        mask_slice[:] = np.logical_or(mask_slice, kernel)
+        starts += [edge.node_a['centroid'], edge.node_b['centroid']]
+        ends += [edge.node_a['centroid'] + length * edge['start_direction'],
+                 edge.node_b['centroid'] + length * edge['end_direction']]
+        values += [start_value, end_value]
+    ends = np.minimum(upper, np.maximum([0, 0, 0], np.asarray(ends, dtype=np.float64).reshape(-1, 3)))
+    coords, segments = rasterize_segments(np.asarray(starts, dtype=np.float64).reshape(-1, 3), ends)
+    canvas.set_voxels(coords, np.asarray(values)[segments])
+
+    return __get_result(image, canvas)
+
+
+def __print_kernels(canvas: RenderCanvas, nodes, value) -> None:
+    centres = np.array([node.coords for node in nodes], dtype=np.int64).reshape(-1, 3)
+    if value != 0:
+        radii = np.full(len(centres), value, dtype=np.int64)
+    else:
+        radii = np.array([int(node['thickness']) for node in nodes], dtype=np.int64)
+
+    for coords in get_sphere_voxels(centres, radii, canvas.shape):
+        canvas.set_voxels(coords, value)
+
+
+def get_sphere_voxels(centres: np.ndarray, radii: np.ndarray, shape: tuple,
+                      max_chunk_voxels: int = SPHERE_CHUNK_VOXELS) -> Iterator[np.ndarray]:
+    centres, radii = np.asarray(centres, dtype=np.int64).reshape(-1, 3), np.asarray(radii, dtype=np.int64)
+    for radius in np.unique(radii).tolist():
+        dtype = np.int16 if max(shape) + radius < 2 ** 15 else np.int32
+        offsets = __get_ball_offsets(radius).astype(dtype)
+        group = centres[radii == radius].astype(dtype)
+        chunk = max(max_chunk_voxels // len(offsets), 1)
+        for begin in range(0, len(group), chunk):
+            coords = (group[begin:begin + chunk, None, :] + offsets[None]).reshape(-1, 3)
+            yield coords[np.all((coords >= 0) & (coords < shape), axis=1)]
+
+
+def draw_edges(image, edges, edge_size: any = 'mean_thickness', interpolate=True, edges_to_highlight=None,
+               radius: any = None):  # TODO: Make edge_size be size not color
+    canvas = __get_canvas(image)
+    highlighted = set() if edges_to_highlight is None else set(edges_to_highlight)
+    fill_values = np.array([50 if edge in highlighted else edge[edge_size] if type(edge_size) is str else edge_size
+                            for edge in edges], dtype=np.float64)
+    radii = None if radius is None else np.array([edge[radius] if type(radius) is str else radius for edge in edges],
+                                                 dtype=np.float64)
+    if interpolate:
+        starts = np.array([edge.node_a.coords for edge in edges], dtype=np.float64).reshape(-1, 3)
+        ends = np.array([edge.node_b.coords for edge in edges], dtype=np.float64).reshape(-1, 3)
+        coords, segments = rasterize_segments(starts, ends)
+    else:
+        voxels = [np.asarray(edge['voxels'], dtype=np.int64).reshape(-1, 3) for edge in edges]
+        coords = np.concatenate(voxels) if len(voxels) > 0 else np.zeros((0, 3), dtype=np.int64)
+        segments = np.repeat(np.arange(len(voxels)), [len(x) for x in voxels])
+    if radii is not None:
+        coords, segments = expand_to_tubes(coords, segments, radii)
+    canvas.set_voxels(coords, fill_values[segments])
+    return __get_result(image, canvas)
+
+
+def rasterize_segments(starts: np.ndarray, ends: np.ndarray, endpoint=False) -> tuple[np.ndarray, np.ndarray]:
+    starts, ends = np.asarray(starts, dtype=np.float64), np.asarray(ends, dtype=np.float64)
+    deltas = ends - starts
+    counts = np.ceil(np.max(np.abs(deltas), axis=1, initial=0)).astype(np.int64) + (1 if endpoint else 0)
+    divisors = np.maximum(counts - 1 if endpoint else counts, 1)
+    steps = deltas / divisors[:, None]
+    segments = np.repeat(np.arange(len(starts)), counts)
+    positions = np.arange(len(segments)) - np.repeat(np.cumsum(counts) - counts, counts)
+    points = positions[:, None] * steps[segments] + starts[segments]
+    if endpoint:
+        last = np.cumsum(counts)[counts > 1] - 1
+        points[last] = ends[counts > 1]
+    # Same rounding as skimage.draw.line_nd, which floors lines starting on .5 with unit steps
+    floored = (starts % 1 == 0.5) & (steps == 1) & (counts[:, None] > 1)
+    return np.where(floored[segments], np.floor(points), np.round(points)).astype(np.int64), segments
+
+
+def expand_to_tubes(coords: np.ndarray, segments: np.ndarray, radii: np.ndarray,
+                    max_chunk_voxels: int = 2 ** 24) -> tuple[np.ndarray, np.ndarray]:
+    point_radii = np.rint(np.asarray(radii, dtype=np.float64)[segments]).astype(np.int64)
+    steps = np.diff(coords, axis=0, prepend=coords[:1])
+    # Consecutive points of a segment only add the part of their ball not covered by the previous point
+    continued = np.zeros(len(coords), dtype=bool)
+    continued[1:] = ((segments[1:] == segments[:-1]) & (point_radii[1:] == point_radii[:-1])
+                     & (np.max(np.abs(steps[1:]), axis=1, initial=0) <= 1))
+    step_codes = np.where(continued, (steps + 1) @ np.array([9, 3, 1]), -1)
+    tube_coords, tube_segments = [coords[point_radii <= 0]], [segments[point_radii <= 0]]
+    for radius in np.unique(point_radii[point_radii > 0]).tolist():
+        selected = point_radii == radius
+        for step_code in np.unique(step_codes[selected]).tolist():
+            points = np.flatnonzero(selected & (step_codes == step_code))
+            offsets = __get_ball_increment(radius, step_code)
+            chunk = max(max_chunk_voxels // max(len(offsets), 1), 1)
+            for begin in range(0, len(points), chunk):
+                chunk_points = points[begin:begin + chunk]
+                tube_coords.append((coords[chunk_points, None, :] + offsets[None]).reshape(-1, 3))
+                tube_segments.append(np.repeat(segments[chunk_points], len(offsets)))
+    return np.concatenate(tube_coords), np.concatenate(tube_segments)
+
+
+@cache
+def __get_ball_offsets(radius: int) -> np.ndarray:
+    return np.argwhere(morphology.ball(radius)) - radius
+
+
+@cache
+def __get_ball_increment(radius: int, step_code: int) -> np.ndarray:
+    offsets = __get_ball_offsets(radius)
+    if step_code < 0:
+        return offsets
+    ball = np.pad(morphology.ball(radius).astype(bool), 1)
+    step = np.array(np.unravel_index(step_code, (3, 3, 3))) - 1
+    previous = offsets + step + radius + 1
+    return offsets[~ball[tuple(previous.T)]]
+
+
+def __get_canvas(image) -> RenderCanvas:
+    if isinstance(image, RenderCanvas):
+        return image
+    return RenderCanvas(image.shape, image.dtype, image.copy(), clear=False)
+
+
+def __get_result(image, canvas: RenderCanvas):
+    return canvas if isinstance(image, RenderCanvas) else canvas.image
 
-    kernels_image = kernels_image[
-                    max_kernel_radius:-max_kernel_radius,
-                    max_kernel_radius:-max_kernel_radius,
-                    max_kernel_radius:-max_kernel_radius
-                    ]
 
-    image[kernels_image == 1] = value
-    return image
-
-
-def __spherical_kernel(outer_radius, thickness=1, filled=True):
-    outer_sphere = morphology.ball(radius=outer_radius)
-    if filled:
-        return outer_sphere
-
-    thickness = min(thickness, outer_radius)
-
-    inner_radius = outer_radius - thickness
-    inner_sphere = morphology.ball(radius=inner_radius)
-
-    begin = outer_radius - inner_radius
-    end = begin + inner_sphere.shape[0]
-    outer_sphere[begin:end, begin:end, begin:end] -= inner_sphere
-    return outer_sphere
-
-
-def draw_edges(image, edges, edge_size: any = 'mean_thickness', interpolate=True, edges_to_highlight=None):  # TODO: Make edge_size be size not color
-    image = image.copy()
-    for i, edge in enumerate(edges):
-        if edges_to_highlight is not None and edge in edges_to_highlight:
-            fill_value = 50
-        elif type(edge_size) is str:
-            fill_value = edge[edge_size]
-        else:
-            fill_value = edge_size
+def draw_central_line(image, dag):
+    canvas = __get_canvas(image)
+    draw_edges(canvas, dag.edges, edge_size=1, interpolate=False)
+    voxels = [np.asarray(n['voxels'], dtype=np.int64).reshape(-1, 3) for n in dag.nodes]
+    if len(voxels) > 0:
+        canvas.set_voxels(np.concatenate(voxels), 1)
 
-        if interpolate:
-            image[line_nd(edge.node_a.coords, edge.node_b.coords)] = fill_value
-        else:
-            for v in edge['voxels']:
-                image[tuple(v)] = fill_value
+    return __get_result(image, canvas)
 
-    return image
 
+def get_central_line(dag: DAG, dtype: np.dtype = np.uint8) -> np.ndarray:
+    return draw_central_line(RenderCanvas(dag.get_shape(), dtype), dag).image
 
-def draw_central_line(image, dag):
-    image_with_edges = draw_edges(image, dag.edges, edge_size=1, interpolate=False)
-    for n in dag.nodes:
-        for v in n['voxels']:
-            image_with_edges[tuple(v)] = 1
 
-    return image_with_edges
+def get_cached_central_line(reader: Reader, step: Reader.DataStep = Reader.DataStep.DAG_FILENAME,
+                            dtype: np.dtype = np.uint8) -> np.ndarray:
+    return ProductCache(reader).get_or_compute(step, get_central_line, dtype)
 
 
 def visualize_addition(partial, full):
@@ -141,7 +206,7 @@ def visualize_skeleton(skeleton, mask):
 
 
 def visualize_lsd(lsd_mask):
-    ColorMapVisualizer(lsd_mask.astype(np.uint8)).visualize()
+    ColorMapVisualizer(lsd_mask.astype(np.uint8, copy=False)).visualize()
 
 
 def visualize_marked_voxels(background: np.ndarray, marked_voxels: np.ndarray[tuple], voxel_radius: int = 10,
@@ -152,12 +217,12 @@ def visualize_marked_voxels(background: np.ndarray, marked_voxels: np.ndarray[tu
         def funct(voxel: tuple) -> int: return 4
 
         color_function = funct
-    visualisation = np.zeros(background.shape)
-    visualisation[background > 0] = 1
+    canvas = RenderCanvas(background.shape, np.uint8)
+    canvas.image[background > 0] = 1
     for marked_voxel, mark_radius in zip(marked_voxels, voxel_radius):
-        x, y, z = tuple(marked_voxel)
-        visualisation[x - mark_radius: x + mark_radius, y - mark_radius: y + mark_radius, z - mark_radius: z + mark_radius] = color_function(marked_voxel)
-    visualize_lsd(visualisation)
+        canvas.set_box(np.subtract(marked_voxel, mark_radius), np.add(marked_voxel, mark_radius),
+                       color_function(marked_voxel))
+    visualize_lsd(canvas.image)
 
 
 def visualize_gradient(lsd_mask):
@@ -172,19 +237,16 @@ def visualize_mask_bin(mask):
     VolumeVisualizer((mask > 0).astype(np.uint8), binary=True).visualize()
 
 
+def get_cached_graph(reader: Reader, step: Reader.DataStep = Reader.DataStep.DAG_FILENAME) -> np.ndarray:
+    return ProductCache(reader).get_or_compute(step, draw_graph)
+
+
 def draw_graph(graph: DAG):
     mask = np.zeros(graph.get_shape(), dtype=np.uint8)
-    for edge in graph.edges:
-        node1, node2 = edge.node_a, edge.node_b
-        x1, y1, z1 = node1.coords
-        x2, y2, z2 = node2.coords
-        line_x = np.linspace(x1, x2, num=300, endpoint=True, dtype=np.int32)
-        line_y = np.linspace(y1, y2, num=300, endpoint=True, dtype=np.int32)
-        line_z = np.linspace(z1, z2, num=300, endpoint=True, dtype=np.int32)
-        for i in range(len(line_x)):
-            mask[line_x[i], line_y[i], line_z[i]] = 255
-
-    for node in graph.nodes:
-        x, y, z = node.coords
-        mask[x, y, z] = 40
+    starts = np.array([edge.node_a.coords for edge in graph.edges]).reshape(-1, 3)
+    ends = np.array([edge.node_b.coords for edge in graph.edges]).reshape(-1, 3)
+    lines = np.linspace(starts, ends, num=300, endpoint=True, dtype=np.int32, axis=1)
+    mask[tuple(lines.reshape(-1, 3).T)] = 255
+
+    mask[tuple(np.array([node.coords for node in graph.nodes]).reshape(-1, 3).T)] = 40
     return mask